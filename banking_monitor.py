@@ -1,18 +1,88 @@
 #!/usr/bin/python3
+import argparse
+import collections
+import concurrent.futures
 import logging
 import sys
 import time
 from lib import Account
+from lib import FinTSSession
+from lib import FileWatcher
+from lib import Rules
+from lib import Scheduler
+from lib import MetricsServer
+from lib import metrics
+from lib import Storage
 from lib import EventLightweightPush
+from lib import EventDispatcher
+from lib import Event
+from lib import RateLimiter, RateLimitExceeded
+from lib import read_transactions, replay
+from lib import Backfill, open_archive
+from lib import ClusterCoordinator, ClusterWorker
+from lib import setup_logging
+from lib import profiler
+import datetime
 import os
 import xml.etree.ElementTree
 import signal
 import base64
+import socket
+import subprocess
+import threading
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 # Global list of accounts to handle.
 accounts = list()
 events = dict()
 
+# Configuration the events and accounts were created from (compared on a reload): attributes of each
+# event by id, accounts by their configuration key and the check interval of each account.
+event_configs = dict()  # type: Dict[int, Dict[str, str]]
+account_configs = dict()  # type: Dict[Tuple, Account]
+account_intervals = dict()  # type: Dict[Account, int]
+
+# Set by SIGHUP to reload the configuration file in the main loop.
+reload_requested = False
+
+# Set by SIGTERM to shut down gracefully in the main loop.
+shutdown_requested = False
+
+# Set by SIGUSR1 (deterministic) or SIGUSR2 (sampling) to profile the next rounds in the main loop.
+profile_requested = None  # type: Optional[str]
+
+# Shared FinTS sessions of the bank logins.
+sessions = dict()
+
+# Shared rules of the csv files and the watcher reloading them on changes.
+rules_files = dict()
+file_watcher = None  # type: FileWatcher
+
+# Dispatcher sending the notifications of all events.
+dispatcher = None  # type: EventDispatcher
+
+# Storage of the state of the accounts and the general settings (except the check interval) it was started with.
+storage = None  # type: Storage
+general_settings = dict()  # type: Dict[str, str]
+
+# Free check slots per FinTS URL and the session groups waiting for a free slot. Checks only start with a
+# slot of their bank, hence no pool thread waits for a busy bank while checks of other banks are due.
+bank_slots = dict()  # type: Dict[str, int]
+bank_queues = dict()  # type: Dict[str, collections.deque]
+bank_lock = threading.Lock()
+
+# Rate limiters of the requests per FinTS URL (shared by all sessions using the URL).
+rate_limiters = dict()  # type: Dict[str, RateLimiter]
+
+# Scheduler deciding when each account is checked.
+scheduler = None  # type: Scheduler
+
+# Sharding of the accounts: worker processes started by the coordinator, the connection of a worker to the
+# coordinator and the accounts this worker is responsible for.
+worker_processes = dict()  # type: Dict[str, subprocess.Popen]
+cluster_worker = None  # type: ClusterWorker
+assigned_accounts = set()  # type: Set[Account]
+
 def make_path(input_location: str) -> str:
     """
     Function creates a path location for the given user input.
@@ -31,134 +101,1138 @@ def make_path(input_location: str) -> str:
     return os.path.dirname(os.path.abspath(__file__)) + "/" + input_location
 
 
+def process_accounts(session_accounts: List[Account], handled_accounts: Set[Account]):
+    """
+    Checks the given accounts sharing one FinTS session for new transactions. Exceptions are handled
+    per account to not influence the processing of other accounts.
+
+    :param session_accounts: accounts to process.
+    :param handled_accounts: set the accounts are added to once they are finished or delayed in the scheduler.
+    """
+
+    for account in session_accounts:
+        logging.debug("Checking account '%s' with IBAN '%s'.", account.name, account.iban)
+        success = False
+        delay = None
+        try:
+            with metrics.phase(account.iban, "check"):
+                account.check()
+                account.clean_up()
+            success = True
+
+        # Accounts over the request limit of their bank are checked later without counting as failure.
+        except RateLimitExceeded as e:
+            delay = e.retry_after
+            logging.info("%s Delaying check of account '%s' with IBAN '%s' by %d seconds.",
+                         e, account.name, account.iban, delay)
+        except Exception as e:
+            logging.exception("Not able to process account '%s' with IBAN '%s'.",
+                              account.name, account.iban)
+        finally:
+            if delay is not None:
+                scheduler.delay(account, delay)
+            else:
+                scheduler.finish(account, success)
+            handled_accounts.add(account)
+
+
+def run_checks(executor: concurrent.futures.Executor, session_accounts: List[Account]):
+    """
+    Runs process_accounts() for the given accounts (profiled if profiling is running) with a slot of their
+    bank. Accounts whose check did not finish because of an error outside of the checks are scheduled
+    again as failed. The slot is handed over to the next session waiting for the bank afterwards.
+
+    :param executor: executor running the checks.
+    :param session_accounts: accounts to process.
+    """
+    handled_accounts = set()  # type: Set[Account]
+    try:
+        profiler.run(process_accounts, session_accounts, handled_accounts)
+    except Exception as e:
+        logging.exception("Not able to process accounts.")
+    finally:
+        # Accounts already handled may be running again (e.g., after a short delay).
+        for account in session_accounts:
+            if account not in handled_accounts:
+                scheduler.finish(account, False)
+
+        url = session_accounts[0].url
+        with bank_lock:
+            next_accounts = None
+            if bank_queues[url]:
+                next_accounts = bank_queues[url].popleft()
+            else:
+                bank_slots[url] += 1
+        if next_accounts is not None:
+            executor.submit(run_checks, executor, next_accounts)
+
+
+def submit_checks(executor: concurrent.futures.Executor, session_accounts: List[Account]):
+    """
+    Submits the checks of the given accounts sharing one FinTS session if their bank has a free slot,
+    otherwise they wait for the slot of a finishing check of the bank.
+
+    :param executor: executor running the checks.
+    :param session_accounts: accounts to process.
+    """
+    url = session_accounts[0].url
+    with bank_lock:
+        if bank_slots[url] <= 0:
+            bank_queues[url].append(session_accounts)
+            return
+        bank_slots[url] -= 1
+    executor.submit(run_checks, executor, session_accounts)
+
+
 def sigterm_handler(signum, frame):
     """
-    Signal handler for sigterm to gracefully shutdown threads.
+    Signal handler for sigterm to gracefully shutdown threads. The threads are shut down by the main loop
+    since sending the remaining notifications from the handler could deadlock with the main loop.
 
     :param signum:
     :param frame:
     """
 
-    logging.info("Shutting down threads.")
+    global shutdown_requested
+
+    # The coordinator stops its workers and exits right away.
+    if scheduler is None:
+        logging.info("Shutting down workers.")
+        for process in worker_processes.values():
+            process.terminate()
+        for process in worker_processes.values():
+            try:
+                process.wait(30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        sys.exit(0)
+
+    shutdown_requested = True
+    scheduler.wake()
+
+
+def sighup_handler(signum, frame):
+    """
+    Signal handler for sighup to reload the configuration file.
+
+    :param signum:
+    :param frame:
+    """
+
+    global reload_requested
+
+    # The coordinator passes the signal on to its workers.
+    for process in worker_processes.values():
+        process.send_signal(signal.SIGHUP)
+
+    reload_requested = True
+    if scheduler is not None:
+        scheduler.wake()
+
+
+def sigusr_handler(signum, frame):
+    """
+    Signal handler for sigusr1 and sigusr2 to profile the next rounds (deterministic or sampling).
+    Sigusr2 additionally writes the current stacks of all threads.
+
+    :param signum:
+    :param frame:
+    """
+
+    global profile_requested
+
+    # The coordinator passes the signal on to its workers.
+    for process in worker_processes.values():
+        process.send_signal(signum)
+
+    if signum == signal.SIGUSR2:
+        try:
+            logging.info("Wrote thread stacks to '%s'.", profiler.write_thread_stacks())
+        except Exception as e:
+            logging.exception("Not able to write thread stacks.")
+
+    if scheduler is None:
+        return
+    profile_requested = "sampling" if signum == signal.SIGUSR2 else "deterministic"
+    scheduler.wake()
+
+
+def create_event(id: int, attrib: Dict[str, str]) -> Event:
+    """
+    Creates an event from its configuration.
+
+    :param id: id of the event.
+    :param attrib: attributes of the event element.
+    :return: event object.
+    """
+    event_type = attrib["type"]
+
+    # Parse lightweightpush Event.
+    if event_type.upper() == "LIGHTWEIGHTPUSH":
+
+        username = attrib["username"]
+        password = attrib["password"]
+        shared_secret = attrib["sharedSecret"]
+        channel = attrib["channel"]
+        digest = attrib.get("digest", "none").lower()
+        digest_window = int(attrib.get("digestWindow", "0"))
+        if digest_window < 0:
+            raise ValueError("Digest window of event '%d' has to be at least 0." % id)
+        max_msg_size = int(attrib.get("maxMsgSize", "2500"))
+        if max_msg_size < EventLightweightPush.MIN_MSG_SIZE:
+            raise ValueError("Maximum message size of event '%d' has to be at least %d."
+                             % (id, EventLightweightPush.MIN_MSG_SIZE))
+
+        return EventLightweightPush(id,
+                                    dispatcher,
+                                    username,
+                                    password,
+                                    shared_secret,
+                                    channel,
+                                    digest,
+                                    digest_window,
+                                    max_msg_size)
+
+    # Unknown event type reached.
+    raise ValueError("Unknown event type '%s'." % event_type)
+
+
+def parse_account(item: xml.etree.ElementTree.Element, check_interval: int) -> Dict[str, Any]:
+    """
+    Parses and validates the configuration of an account.
+
+    :param item: account element.
+    :param check_interval: default check interval.
+    :return: dictionary with the settings of the account.
+    """
+    name = item.attrib["name"]
+    csv = make_path(item.attrib["csvFile"])
+    user = item.attrib["user"]
+    if item.attrib["passwordType"].upper() == "PLAIN":
+        password = item.attrib["password"]
+    elif item.attrib["passwordType"].upper() == "BASE64":
+        password = base64.b64decode(item.attrib["password"].encode("utf-8")).decode('utf-8')
+    else:
+        raise ValueError("Unknown password type '%s'." % item.attrib["passwordType"])
+    interval = int(item.attrib.get("checkInterval", str(check_interval)))
+    if interval <= 0:
+        raise ValueError("Check interval of account '%s' has to be larger than 0." % name)
+
+    if not os.path.isfile(csv):
+        raise ValueError("No file '%s'." % csv)
+
+    event_ids = list()
+    for event_xml in item.iterfind("event"):
+        event_ids.append(int(event_xml.text))
+
+    # Accounts with the same csv file share their rules.
+    return {"name": name,
+            "csv": os.path.realpath(csv),
+            "user": user,
+            "password": password,
+            "iban": item.attrib["iban"].strip().replace(" ", ""),
+            "blz": item.attrib["blz"],
+            "url": item.attrib["fintsURL"],
+            "interval": interval,
+            "event_ids": event_ids}
+
+
+def create_account(config: Dict[str, Any]) -> Account:
+    """
+    Creates an account from its configuration. The FinTS session of the bank login and the rules of the
+    csv file are shared with the other accounts that use them.
+
+    :param config: settings of the account as returned by parse_account().
+    :return: account object.
+    """
+
+    # Accounts with the same bank login share one session.
+    session_key = FinTSSession.get_key(config["user"], config["blz"], config["url"])
+    if session_key not in sessions.keys():
+        if config["url"] not in rate_limiters.keys():
+            rate_limiters[config["url"]] = RateLimiter(config["url"])
+        sessions[session_key] = FinTSSession(config["user"],
+                                             config["password"],
+                                             config["blz"],
+                                             config["url"],
+                                             session_ttl,
+                                             rate_limiter=rate_limiters[config["url"]])
+    session = sessions[session_key]
+
+    # Accounts with the same csv file share their rules.
+    csv = config["csv"]
+    if csv not in rules_files.keys():
+        rules_files[csv] = Rules(csv)
+        file_watcher.register(csv, rules_files[csv].reload)
+
+    account = Account(config["name"], session, config["iban"], rules_files[csv], storage, overlap_days)
+
+    with bank_lock:
+        if account.url not in bank_slots.keys():
+            bank_slots[account.url] = max_concurrency_per_bank
+            bank_queues[account.url] = collections.deque()
+
+    return account
+
+
+def is_scheduled(account: Account) -> bool:
+    """
+    Checks if the given account is checked by this process.
+
+    :param account: account to check.
+    :return: True if the account is in the schedule.
+    """
+    return cluster_worker is None or account in assigned_accounts
+
+
+def parse_config(config_root: xml.etree.ElementTree.Element,
+                 check_interval: int) -> Tuple[Dict[int, Dict[str, str]],
+                                               Dict[int, Event],
+                                               Dict[str, RateLimiter],
+                                               Dict[Tuple, Dict[str, Any]]]:
+    """
+    Parses and validates the events, rate limits and accounts of the given configuration without changing
+    the running ones. Only events that are new or changed are created.
+
+    :param config_root: root element of the configuration file.
+    :param check_interval: default check interval of the accounts.
+    :return: tuple of the event settings by id, the created events by id, the rate limiters by FinTS URL
+             and the account settings by their key.
+    """
+
+    # Parse events and create the new or changed ones.
+    new_event_configs = dict()
+    new_events = dict()
+    for item in config_root.find("events").iterfind("event"):
+        id = int(item.attrib["id"])
+
+        # Check if the event id is unique.
+        if id in new_event_configs.keys():
+            raise ValueError("Event id '%d' not unique." % id)
+
+        new_event_configs[id] = dict(item.attrib)
+        if event_configs.get(id) != new_event_configs[id]:
+            new_events[id] = create_event(id, new_event_configs[id])
+
+    # Parse optional rate limits of the banks (banks without rate limit are not limited).
+    new_rate_limiters = dict()
+    rate_limits_xml = config_root.find("rateLimits")
+    if rate_limits_xml is not None:
+        for item in rate_limits_xml.iterfind("rateLimit"):
+            url = item.attrib["fintsURL"]
+            if url in new_rate_limiters.keys():
+                raise ValueError("Rate limit for '%s' not unique." % url)
+            new_rate_limiters[url] = RateLimiter(url,
+                                                 float(item.attrib.get("requestsPerMinute", "0")),
+                                                 int(item.attrib.get("burst", "1")),
+                                                 int(item.attrib.get("dailyBudget", "0")),
+                                                 float(item.attrib.get("maxWait", "30")))
+
+    # Parse accounts.
+    new_account_configs = dict()
+    session_passwords = dict()
+    for item in config_root.find("accounts").iterfind("account"):
+        config = parse_account(item, check_interval)
+
+        for event_id in config["event_ids"]:
+            if event_id not in new_event_configs.keys():
+                raise ValueError("Event id '%d' does not exist." % event_id)
+
+        session_key = FinTSSession.get_key(config["user"], config["blz"], config["url"])
+        if session_passwords.setdefault(session_key, config["password"]) != config["password"]:
+            raise ValueError("Account '%s' uses a different password for user '%s' at '%s'."
+                             % (config["name"], config["user"], config["url"]))
+
+        key = (config["name"],
+               config["csv"],
+               config["user"],
+               config["password"],
+               config["iban"],
+               config["blz"],
+               config["url"])
+        if key in new_account_configs.keys():
+            raise ValueError("Account '%s' configured twice." % config["name"])
+        new_account_configs[key] = config
+
+    return new_event_configs, new_events, new_rate_limiters, new_account_configs
+
+
+def add_accounts(configs: List[Tuple[Tuple, Dict[str, Any]]], on_ready: Optional[Callable[[], None]] = None) -> int:
+    """
+    Creates and schedules the given new accounts. Their rules have to be loaded already.
+
+    :param configs: keys and settings of the accounts as returned by parse_config().
+    :param on_ready: function called after the accounts were scheduled.
+    :return: number of added accounts.
+    """
+    for key, config in configs:
+        logging.info("Adding account '%s' with IBAN '%s'.", config["name"], config["iban"])
+        account = create_account(config)
+        for event_id in config["event_ids"]:
+            account.register_event(events[event_id])
+        account_configs[key] = account
+        accounts.append(account)
+        account_intervals[account] = config["interval"]
+        if cluster_worker is None:
+            scheduler.add(account, config["interval"], start_jitter)
+
+    if on_ready is not None and cluster_worker is None:
+        on_ready()
+    return len(configs)
+
+
+def apply_config(config_root: xml.etree.ElementTree.Element,
+                 check_interval: int,
+                 on_ready: Optional[Callable[[], None]] = None):
+    """
+    Creates the events and accounts of the given configuration. On a reload only the events and accounts
+    that changed are replaced: unchanged accounts keep their state, FinTS session and rules. The whole
+    configuration, including the rules files of new accounts, is validated before anything is changed.
+    The rules files are loaded in parallel. The accounts of the initial configuration are scheduled as soon
+    as their rules file is loaded.
+
+    :param config_root: root element of the configuration file.
+    :param check_interval: default check interval of the accounts.
+    :param on_ready: function called each time new accounts were scheduled (e.g., to start their checks
+                     while the remaining rules files are still loading).
+    """
+    new_event_configs, new_events, new_rate_limiters, new_account_configs = parse_config(config_root,
+                                                                                         check_interval)
+
+    # Load the missing rules files in parallel. On a reload all of them are loaded before anything is changed,
+    # hence an unreadable file keeps the current configuration. The accounts of the initial configuration are
+    # instead added as soon as their rules file is loaded (there is nothing to keep if loading fails).
+    used_csvs = set(map(lambda x: x["csv"], new_account_configs.values()))
+    loaded_rules = dict()  # type: Dict[str, Rules]
+    if account_configs or event_configs:
+        missing_csvs = sorted(used_csvs - set(rules_files.keys()))
+        with concurrent.futures.ThreadPoolExecutor(thread_name_prefix="RulesLoader") as loader:
+            loaded_rules = dict(zip(missing_csvs, loader.map(Rules, missing_csvs)))
+
+    # Replace changed events and remove deleted ones (after sending their collected notifications).
+    num_events_removed = 0
+    for id in list(events.keys()):
+        if id not in new_event_configs.keys() or id in new_events.keys():
+            events.pop(id).flush(force=True)
+            del event_configs[id]
+            if id not in new_event_configs.keys():
+                num_events_removed += 1
+    for id, event in new_events.items():
+        events[id] = event
+        event_configs[id] = new_event_configs[id]
+
+    # Change the rate limits of the banks in place to keep the requests made so far.
+    for url, rate_limiter in rate_limiters.items():
+        if url not in new_rate_limiters.keys():
+            rate_limiter.configure(0.0, 1, 0, rate_limiter.max_wait)
+    for url, rate_limiter in new_rate_limiters.items():
+        if url in rate_limiters.keys():
+            rate_limiters[url].configure(rate_limiter.rate * 60.0,
+                                         rate_limiter.burst,
+                                         rate_limiter.daily_budget,
+                                         rate_limiter.max_wait)
+        else:
+            if cluster_worker is not None:
+                rate_limiter.set_num_workers(cluster_worker.get_num_workers())
+            rate_limiters[url] = rate_limiter
+
+    # Remove deleted or changed accounts.
+    num_accounts_removed = 0
+    for key in list(account_configs.keys()):
+        if key in new_account_configs.keys():
+            continue
+        account = account_configs.pop(key)
+        logging.info("Removing account '%s' with IBAN '%s'.", account.name, account.iban)
+        scheduler.remove(account)
+        assigned_accounts.discard(account)
+        accounts.remove(account)
+        del account_intervals[account]
+        num_accounts_removed += 1
+
+    # Drop sessions and rules no longer used by any account.
+    used_sessions = set(map(lambda x: x.session, accounts))
+    for session_key in list(sessions.keys()):
+        if sessions[session_key] not in used_sessions:
+            del sessions[session_key]
+    for csv in list(rules_files.keys()):
+        if csv not in used_csvs:
+            file_watcher.unregister(csv, rules_files[csv].reload)
+            del rules_files[csv]
+    for csv, rules in loaded_rules.items():
+        rules_files[csv] = rules
+        file_watcher.register(csv, rules.reload)
+
+    # Update the events and check intervals of the existing accounts.
+    new_configs = dict()  # type: Dict[str, List[Tuple[Tuple, Dict[str, Any]]]]
+    for key, config in new_account_configs.items():
+        account = account_configs.get(key)
+        if account is None:
+            new_configs.setdefault(config["csv"], list()).append((key, config))
+            continue
+
+        if account_intervals[account] != config["interval"]:
+            logging.info("Changing check interval of account '%s' with IBAN '%s' to %d seconds.",
+                         account.name, account.iban, config["interval"])
+            account_intervals[account] = config["interval"]
+            if is_scheduled(account):
+                scheduler.remove(account)
+                scheduler.add(account, config["interval"], start_jitter)
+
+        account.events = list()
+        for event_id in config["event_ids"]:
+            account.register_event(events[event_id])
+
+    # Add the new accounts grouped by their rules file. Accounts with already loaded rules come first,
+    # the others (only in the initial configuration) follow as soon as their rules file is loaded.
+    num_accounts_added = 0
+    with concurrent.futures.ThreadPoolExecutor(thread_name_prefix="RulesLoader") as loader:
+        futures = dict()
+        for csv in new_configs.keys():
+            if csv not in rules_files.keys():
+                futures[loader.submit(Rules, csv)] = csv
+
+        for csv in list(new_configs.keys()):
+            if csv in rules_files.keys():
+                num_accounts_added += add_accounts(new_configs[csv], on_ready)
+
+        for future in concurrent.futures.as_completed(futures.keys()):
+            csv = futures[future]
+            rules_files[csv] = future.result()
+            file_watcher.register(csv, rules_files[csv].reload)
+            num_accounts_added += add_accounts(new_configs[csv], on_ready)
+
+    # Accounts of a worker are scheduled when it is responsible for them.
+    if cluster_worker is not None:
+        update_assigned_accounts()
+
+    logging.info("Configured %d account(s) (%d added, %d removed) and %d event(s) (%d created, %d removed).",
+                 len(accounts), num_accounts_added, num_accounts_removed,
+                 len(events), len(new_events), num_events_removed)
+
+
+def reload_config():
+    """
+    Reloads the configuration file and applies the changed events and accounts. If the configuration
+    file is invalid, the current configuration is kept.
+    """
+    logging.info("Reloading config file.")
+    try:
+        config_root = xml.etree.ElementTree.parse(make_path("config/config.xml")).getroot()
+
+        general_attrib = dict(config_root.find("general").attrib)
+        check_interval = int(general_attrib.pop("checkInterval"))
+        if check_interval <= 0:
+            raise ValueError("Check interval has to be larger than 0.")
+        if general_attrib != general_settings:
+            logging.warning("Changed general settings (except checkInterval) need a restart.")
+
+        apply_config(config_root, check_interval)
+
+    except Exception as e:
+        logging.exception("Not able to reload config file. Keeping the current configuration.")
+
+
+def get_worker_status() -> Dict[str, Any]:
+    """
+    Gets the health and metrics of this worker reported to the coordinator.
+
+    :return: status dictionary.
+    """
+    return {"accounts": len(assigned_accounts),
+            "running": scheduler.get_num_running(),
+            "failing": scheduler.get_num_failing(),
+            "metrics": metrics.get_dict() if metrics.enabled else dict()}
+
+
+def update_assigned_accounts():
+    """
+    Schedules the accounts this worker is responsible for and removes the ones taken over by other workers.
+    """
     for account in accounts:
-        account.exit()
-    logging.info("Waiting for threads to exit.")
-    time.sleep(2)
+        responsible = cluster_worker.is_responsible(account.iban)
+        if responsible and account not in assigned_accounts:
+            logging.info("Taking over account '%s' with IBAN '%s'.", account.name, account.iban)
+
+            # Continue where the previous worker stopped.
+            account.load_state()
+            scheduler.add(account, account_intervals[account], start_jitter)
+            assigned_accounts.add(account)
+
+        elif not responsible and account in assigned_accounts:
+            logging.info("Handing over account '%s' with IBAN '%s'.", account.name, account.iban)
+            scheduler.remove(account)
+            assigned_accounts.discard(account)
+
+    logging.info("Responsible for %d of %d account(s).", len(assigned_accounts), len(accounts))
+
+    # Each worker makes its share of the requests allowed by the rate limits of the banks.
+    num_workers = cluster_worker.get_num_workers()
+    for rate_limiter in rate_limiters.values():
+        rate_limiter.set_num_workers(num_workers)
+
+
+def coordinator_main(address: str, port: int, shared_secret: str, num_workers: int, worker_timeout: int) -> int:
+    """
+    Runs the coordinator of a sharded deployment. It starts the local worker processes (and restarts them
+    if they die) and tracks all workers (local and remote) that send heartbeats.
+
+    :param address: address the coordinator listens on.
+    :param port: port the coordinator listens on.
+    :param shared_secret: secret the workers have to send with each request.
+    :param num_workers: number of worker processes started on this machine.
+    :param worker_timeout: seconds without heartbeat after which a worker is considered dead.
+    :return: exit code.
+    """
+    coordinator = ClusterCoordinator(address, port, shared_secret, worker_timeout)
+    coordinator.start()
+
+    connect_address = "127.0.0.1" if address in ("", "0.0.0.0") else address
+    coordinator_url = "http://%s:%d" % (connect_address, port)
+    host_name = socket.gethostname()
+
+    logging.info("Coordinator listening on %s:%d. Starting %d worker(s).", address, port, num_workers)
+    while True:
+        for i in range(num_workers):
+            worker_id = "%s-%d" % (host_name, i)
+            process = worker_processes.get(worker_id)
+            if process is not None:
+                if process.poll() is None:
+                    continue
+                logging.error("Worker '%s' exited with code %d. Restarting it.", worker_id, process.returncode)
+
+            worker_processes[worker_id] = subprocess.Popen([sys.executable,
+                                                            os.path.abspath(__file__),
+                                                            "--worker",
+                                                            worker_id,
+                                                            "--coordinator",
+                                                            coordinator_url])
+        time.sleep(5)
+
+
+def parse_log_level(name: str) -> int:
+    """
+    Parses the log level of the configuration file.
+
+    :param name: name of the log level.
+    :return: log level of the logging module.
+    """
+    temp_loglevel = name.upper()
+    if temp_loglevel == "DEBUG":
+        return logging.DEBUG
+    elif temp_loglevel == "INFO":
+        return logging.INFO
+    elif temp_loglevel == "WARNING":
+        return logging.WARNING
+    elif temp_loglevel == "ERROR":
+        return logging.ERROR
+    elif temp_loglevel == "CRITICAL":
+        return logging.CRITICAL
+    raise ValueError("Unknown log level '%s'." % name)
+
+
+def parse_settings(config_root: xml.etree.ElementTree.Element) -> Dict[str, Any]:
+    """
+    Parses and validates the general, metrics, profiling and cluster settings of the configuration
+    without creating anything.
+
+    :param config_root: root element of the configuration file.
+    :return: dictionary with the settings.
+    """
+    general = config_root.find("general").attrib
+    settings = dict()  # type: Dict[str, Any]
+
+    settings["log_file"] = make_path(general["logFile"])
+    settings["log_level"] = parse_log_level(general["logLevel"])
+
+    settings["log_format"] = general.get("logFormat", "text").lower()
+    if settings["log_format"] not in ("text", "json"):
+        raise ValueError("Unknown log format '%s'." % settings["log_format"])
+
+    settings["log_max_size"] = int(general.get("logMaxSize", "0"))
+    if settings["log_max_size"] < 0:
+        raise ValueError("Maximum log file size has to be at least 0.")
+
+    settings["log_rotate_interval"] = int(general.get("logRotateInterval", "0"))
+    if settings["log_rotate_interval"] < 0:
+        raise ValueError("Log rotation interval has to be at least 0.")
+
+    settings["log_backup_count"] = int(general.get("logBackupCount", "5"))
+    if ((settings["log_max_size"] > 0 or settings["log_rotate_interval"] > 0)
+       and settings["log_backup_count"] <= 0):
+        raise ValueError("Number of rotated log files has to be larger than 0.")
+
+    settings["check_interval"] = int(general["checkInterval"])
+    if settings["check_interval"] <= 0:
+        raise ValueError("Check interval has to be larger than 0.")
+
+    settings["start_jitter"] = int(general.get("startJitter", "60"))
+    if settings["start_jitter"] < 0:
+        raise ValueError("Start jitter has to be at least 0.")
+
+    settings["max_backoff"] = int(general.get("maxBackoff", "3600"))
+    if settings["max_backoff"] <= 0:
+        raise ValueError("Maximum backoff has to be larger than 0.")
+
+    settings["session_ttl"] = int(general.get("sessionTTL", "3600"))
+    if settings["session_ttl"] < 0:
+        raise ValueError("Session TTL has to be at least 0.")
+
+    settings["overlap_days"] = int(general.get("fetchOverlapDays", "2"))
+    if settings["overlap_days"] < 0:
+        raise ValueError("Fetch overlap days have to be at least 0.")
+
+    settings["state_file"] = make_path(general.get("stateFile", "./state.db"))
+
+    settings["max_concurrency"] = int(general.get("maxConcurrency", "4"))
+    if settings["max_concurrency"] <= 0:
+        raise ValueError("Maximum concurrency has to be larger than 0.")
+
+    settings["max_concurrency_per_bank"] = int(general.get("maxConcurrencyPerBank", "1"))
+    if settings["max_concurrency_per_bank"] <= 0:
+        raise ValueError("Maximum concurrency per bank has to be larger than 0.")
+
+    settings["event_workers"] = int(general.get("eventWorkers", "2"))
+    if settings["event_workers"] <= 0:
+        raise ValueError("Number of event workers has to be larger than 0.")
+
+    settings["event_queue_size"] = int(general.get("eventQueueSize", "1000"))
+    if settings["event_queue_size"] <= 0:
+        raise ValueError("Event queue size has to be larger than 0.")
+
+    settings["event_retries"] = int(general.get("eventRetries", "5"))
+    if settings["event_retries"] < 0:
+        raise ValueError("Number of event retries has to be at least 0.")
+
+    # Optional metrics settings.
+    metrics_xml = config_root.find("metrics")
+    settings["metrics_enabled"] = (metrics_xml is not None
+                                   and metrics_xml.attrib.get("enabled", "false").upper() == "TRUE")
+    settings["metrics_address"] = "127.0.0.1"
+    settings["metrics_port"] = 0
+    settings["metrics_json_file"] = None
+    if settings["metrics_enabled"]:
+        settings["metrics_address"] = metrics_xml.attrib.get("address", "127.0.0.1")
+        settings["metrics_port"] = int(metrics_xml.attrib.get("port", "0"))
+        if not 0 <= settings["metrics_port"] <= 65535:
+            raise ValueError("Metrics port has to be between 0 and 65535.")
+        if metrics_xml.attrib.get("jsonFile", ""):
+            settings["metrics_json_file"] = make_path(metrics_xml.attrib["jsonFile"])
+
+    # Optional profiling settings.
+    profiling_xml = config_root.find("profiling")
+    profiling_attrib = profiling_xml.attrib if profiling_xml is not None else dict()
+    settings["profile_rounds"] = int(profiling_attrib.get("rounds", "1"))
+    if settings["profile_rounds"] <= 0:
+        raise ValueError("Number of profiled rounds has to be larger than 0.")
+
+    settings["profile_sample_interval"] = float(profiling_attrib.get("sampleInterval", "0.01"))
+    if settings["profile_sample_interval"] <= 0:
+        raise ValueError("Sample interval has to be larger than 0.")
+
+    # Optional cluster settings.
+    cluster_xml = config_root.find("cluster")
+    settings["cluster_enabled"] = (cluster_xml is not None
+                                   and cluster_xml.attrib.get("enabled", "false").upper() == "TRUE")
+    cluster_attrib = cluster_xml.attrib if settings["cluster_enabled"] else dict()
+    settings["cluster_address"] = cluster_attrib.get("address", "127.0.0.1")
+    settings["cluster_port"] = int(cluster_attrib.get("port", "9481"))
+    if not 0 < settings["cluster_port"] <= 65535:
+        raise ValueError("Cluster port has to be between 1 and 65535.")
+
+    settings["cluster_secret"] = cluster_attrib.get("sharedSecret", "")
+    if settings["cluster_enabled"] and len(settings["cluster_secret"]) < 16:
+        raise ValueError("Shared secret of the cluster has to have at least 16 characters.")
+
+    settings["num_workers"] = int(cluster_attrib.get("workers", "2"))
+    if settings["num_workers"] < 0:
+        raise ValueError("Number of workers has to be at least 0.")
+
+    settings["heartbeat_interval"] = int(cluster_attrib.get("heartbeatInterval", "10"))
+    if settings["heartbeat_interval"] <= 0:
+        raise ValueError("Heartbeat interval has to be larger than 0.")
+
+    settings["worker_timeout"] = int(cluster_attrib.get("workerTimeout", "30"))
+    if settings["worker_timeout"] <= settings["heartbeat_interval"]:
+        raise ValueError("Worker timeout has to be larger than the heartbeat interval.")
+
+    settings["virtual_nodes"] = int(cluster_attrib.get("virtualNodes", "64"))
+    if settings["virtual_nodes"] <= 0:
+        raise ValueError("Number of virtual nodes has to be larger than 0.")
+
+    return settings
+
+
+def start_checks(executor: concurrent.futures.Executor) -> bool:
+    """
+    Starts the checks of the due accounts.
+
+    :param executor: executor running the checks.
+    :return: True if checks were started.
+    """
+    due_accounts = scheduler.get_due()
+    if not due_accounts:
+        return False
+    logging.debug("Starting checks of %d account(s).", len(due_accounts))
+
+    # Group accounts by their FinTS session and check the bank logins concurrently.
+    session_groups = dict()
+    for account in due_accounts:
+        session_groups.setdefault(account.session, list()).append(account)
+    for group in session_groups.values():
+        submit_checks(executor, group)
+    return True
+
+
+def check_config_main() -> int:
+    """
+    Validates the config file and all rules files without contacting any bank or push server.
+
+    :return: exit code.
+    """
+
+    logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.WARNING)
+
+    try:
+        config_root = xml.etree.ElementTree.parse(make_path("config/config.xml")).getroot()
+        check_interval = parse_settings(config_root)["check_interval"]
+        new_event_configs, _, _, new_account_configs = parse_config(config_root, check_interval)
+    except Exception as e:
+        print("Invalid config file: %s" % repr(e), file=sys.stderr)
+        return 1
+
+    # Invalid rows are logged while parsing.
+    csv_files = sorted(set(map(lambda x: x["csv"], new_account_configs.values())))
+    with concurrent.futures.ThreadPoolExecutor() as loader:
+        num_errors = sum(map(lambda x: x.num_errors, loader.map(Rules, csv_files)))
+
+    print("Config file with %d account(s) and %d event(s) and %d rules file(s) checked: %d error(s)."
+          % (len(new_account_configs), len(new_event_configs), len(csv_files), num_errors), file=sys.stderr)
+    return 0 if num_errors == 0 else 1
+
+
+def replay_main(args: argparse.Namespace) -> int:
+    """
+    Checks recorded transactions against the rules of an account without contacting any bank
+    or push server.
+
+    :param args: command line arguments.
+    :return: exit code.
+    """
+
+    logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.WARNING)
+
+    # Get rules file of the account from the config file if not given directly.
+    csv_file = args.rules
+    if csv_file is None:
+        if args.account is None:
+            print("Either --account or --rules is needed for --replay.", file=sys.stderr)
+            return 1
+        config_root = xml.etree.ElementTree.parse(make_path("config/config.xml")).getroot()
+        for item in config_root.find("accounts").iterfind("account"):
+            if item.attrib["name"] == args.account:
+                csv_file = make_path(item.attrib["csvFile"])
+                break
+        if csv_file is None:
+            print("Account '%s' does not exist." % args.account, file=sys.stderr)
+            return 1
+
+    def on_error(line_num: int, error: str):
+        print("Skipping invalid transaction in line %d: %s" % (line_num, error), file=sys.stderr)
+
+    # A missing or unreadable rules or replay file is reported without a traceback.
+    start_time = time.perf_counter()
+    try:
+        rules = Rules(csv_file)
+        num_alerts, num_allowed = replay(rules,
+                                         read_transactions(args.replay, on_error),
+                                         sys.stdout,
+                                         args.show_allowed)
+    except OSError as e:
+        print(e, file=sys.stderr)
+        return 1
+    duration = time.perf_counter() - start_time
+
+    print("%d transaction(s) would trigger an event, %d are whitelisted (%.2f seconds)."
+          % (num_alerts, num_allowed, duration), file=sys.stderr)
+    return 0
+
+
+def backfill_main(args: argparse.Namespace, max_concurrency: int, max_concurrency_per_bank: int) -> int:
+    """
+    Archives the transactions of the configured accounts and/or seeds the state of the accounts
+    from the archive.
+
+    :param args: command line arguments.
+    :param max_concurrency: maximum number of accounts fetched concurrently.
+    :param max_concurrency_per_bank: maximum number of concurrent requests per FinTS URL.
+    :return: exit code.
+    """
+
+    selected_accounts = accounts
+    if args.account is not None:
+        selected_accounts = list(filter(lambda x: x.name == args.account, accounts))
+        if not selected_accounts:
+            print("Account '%s' does not exist." % args.account, file=sys.stderr)
+            return 1
+
+    archive = open_archive(args.archive)
+    try:
+        exit_code = 0
+        if args.backfill is not None:
+            start_date = datetime.date.fromisoformat(args.backfill)
+            end_date = datetime.date.today()
+            if args.end is not None:
+                end_date = datetime.date.fromisoformat(args.end)
+
+            backfill = Backfill(archive, args.chunk_days, max_concurrency, max_concurrency_per_bank)
+            num_archived, num_failed = backfill.run(selected_accounts, start_date, end_date)
+            print("Archived %d transaction(s) in '%s'." % (num_archived, args.archive))
+            if num_failed > 0:
+                print("Not able to archive %d account(s). Run again to resume."
+                      % num_failed, file=sys.stderr)
+                exit_code = 1
+
+        if args.seed:
+            for account in selected_accounts:
+                end_date = archive.get_progress(account.iban)
+                if end_date is None:
+                    continue
+                num_triggered = account.seed(archive.read(account.iban), end_date)
+                print("Seeded account '%s' up to %s (%d transaction(s) not whitelisted)."
+                      % (account.name, end_date.strftime("%Y-%m-%d"), num_triggered))
+
+        return exit_code
+    finally:
+        archive.close()
 
 
 if __name__ == '__main__':
 
-    # Register sigterm handler to gracefully shutdown the service.
+    parser = argparse.ArgumentParser(description="Monitors banking accounts for unknown transactions.")
+    parser.add_argument("--replay",
+                        metavar="FILE",
+                        help="check recorded transactions (csv or jsonl) against the rules and exit")
+    parser.add_argument("--account", help="name of the account whose rules are used for --replay")
+    parser.add_argument("--rules", metavar="CSV", help="rules file used for --replay instead of an account")
+    parser.add_argument("--show-allowed",
+                        action="store_true",
+                        help="also show whitelisted transactions and their rule for --replay")
+    parser.add_argument("--backfill",
+                        metavar="START",
+                        help="archive the transactions of the accounts from START (YYYY-MM-DD) on and exit")
+    parser.add_argument("--end", help="last day (YYYY-MM-DD) archived by --backfill (default today)")
+    parser.add_argument("--archive",
+                        metavar="FILE",
+                        help="archive used by --backfill and --seed (sqlite if it ends with .db, else csv)")
+    parser.add_argument("--chunk-days",
+                        type=int,
+                        default=30,
+                        help="number of days fetched with one request by --backfill (default 30)")
+    parser.add_argument("--seed",
+                        action="store_true",
+                        help="mark the archived transactions as processed so that they do not trigger events and exit")
+    parser.add_argument("--check-config",
+                        action="store_true",
+                        help="validate the config file and all rules files without contacting any server and exit")
+    parser.add_argument("--worker",
+                        metavar="ID",
+                        help="run as worker of a sharded deployment with the given unique id")
+    parser.add_argument("--coordinator",
+                        metavar="URL",
+                        help="URL of the coordinator for --worker (default from the cluster settings)")
+    args = parser.parse_args()
+
+    if args.replay is not None:
+        sys.exit(replay_main(args))
+    if args.check_config:
+        sys.exit(check_config_main())
+    if (args.backfill is not None or args.seed) and args.archive is None:
+        parser.error("--archive is needed for --backfill and --seed")
+
+    # Register sigterm handler to gracefully shutdown the service and sighup handler to reload the configuration.
     signal.signal(signal.SIGTERM, sigterm_handler)
+    signal.signal(signal.SIGHUP, sighup_handler)
+    signal.signal(signal.SIGUSR1, sigusr_handler)
+    signal.signal(signal.SIGUSR2, sigusr_handler)
 
-    # Parse log settings from file.
+    # Parse settings from file.
     config_root = None
     try:
         config_root = xml.etree.ElementTree.parse(make_path("config/config.xml")).getroot()
+        settings = parse_settings(config_root)
 
-        log_file = make_path(config_root.find("general").attrib["logFile"])
-        temp_loglevel = config_root.find("general").attrib["logLevel"].upper()
-        if temp_loglevel == "DEBUG":
-            log_level = logging.DEBUG
-        elif temp_loglevel == "INFO":
-            log_level = logging.INFO
-        elif temp_loglevel == "WARNING":
-            log_level = logging.WARNING
-        elif temp_loglevel == "ERROR":
-            log_level = logging.ERROR
-        elif temp_loglevel == "CRITICAL":
-            log_level = logging.CRITICAL
-        else:
-            raise ValueError("Unknown log level '%s'." % temp_loglevel)
+        # Initialize logging (workers of a sharded deployment write to their own logfile since
+        # rotating a shared file from several processes would lose records).
+        log_file = settings["log_file"]
+        if args.worker is not None:
+            log_base, log_ext = os.path.splitext(log_file)
+            log_file = "%s.%s%s" % (log_base, args.worker, log_ext)
+        setup_logging(log_file,
+                      settings["log_level"],
+                      settings["log_format"],
+                      settings["log_max_size"],
+                      settings["log_backup_count"],
+                      settings["log_rotate_interval"],
+                      args.worker)
 
-        # Initialize logging.
-        logging.basicConfig(format="%(asctime)s %(levelname)s: %(message)s",
-                            datefmt="%m/%d/%Y %H:%M:%S",
-                            filename=log_file,
-                            level=log_level)
+        # Profiles and thread stacks are written next to the logfile.
+        profiler.output_prefix = os.path.splitext(log_file)[0]
     except Exception as e:
         print(e)
         sys.exit(1)
 
-    # Parse config file.
+    # Run as coordinator of the workers if enabled.
+    coordinator_url = args.coordinator
     try:
-        check_interval = int(config_root.find("general").attrib["checkInterval"])
-        if check_interval <= 0:
-            raise ValueError("Check interval has to be larger than 0.")
+        if settings["cluster_enabled"]:
+            if coordinator_url is None:
+                coordinator_url = "http://%s:%d" % (settings["cluster_address"], settings["cluster_port"])
 
-        # Parse events.
-        for item in config_root.find("events").iterfind("event"):
-            id = int(item.attrib["id"])
-            event_type = item.attrib["type"]
+            # A backfill runs in this process only, without coordinator and workers.
+            if args.worker is None and args.backfill is None and not args.seed:
+                sys.exit(coordinator_main(settings["cluster_address"],
+                                          settings["cluster_port"],
+                                          settings["cluster_secret"],
+                                          settings["num_workers"],
+                                          settings["worker_timeout"]))
 
-            event = None
+        if args.worker is not None and coordinator_url is None:
+            raise ValueError("Coordinator URL needed for worker '%s'." % args.worker)
 
-            # Parse lightweightpush Event.
-            if event_type.upper() == "LIGHTWEIGHTPUSH":
+    except Exception as e:
+        logging.exception("Not able to parse cluster settings.")
+        sys.exit(1)
 
-                username = item.attrib["username"]
-                password = item.attrib["password"]
-                shared_secret = item.attrib["sharedSecret"]
-                channel = item.attrib["channel"]
+    # Set up the components from the settings.
+    try:
+        check_interval = settings["check_interval"]
+        start_jitter = settings["start_jitter"]
+        session_ttl = settings["session_ttl"]
+        overlap_days = settings["overlap_days"]
+        max_concurrency = settings["max_concurrency"]
+        max_concurrency_per_bank = settings["max_concurrency_per_bank"]
 
-                event = EventLightweightPush(id, username, password, shared_secret, channel)
+        scheduler = Scheduler(settings["max_backoff"])
+        storage = Storage(settings["state_file"])
 
-            # Unknown event type reached.
-            else:
-                raise ValueError("Unknown event type '%s'." % event_type)
+        dispatcher = EventDispatcher(settings["event_workers"], settings["event_queue_size"], settings["event_retries"])
+        dispatcher.start()
 
-            # Check if the event id is unique.
-            if event.id in events.keys():
-                raise ValueError("Event id '%d' not unique." % event.id)
+        # Workers report their metrics to the coordinator instead of serving or writing them.
+        metrics_json_file = None
+        if settings["metrics_enabled"]:
+            metrics.enabled = True
 
-            events[event.id] = event
+            if settings["metrics_port"] > 0 and args.worker is None:
+                metrics_server = MetricsServer(metrics, settings["metrics_address"], settings["metrics_port"])
+                metrics_server.start()
 
-        # Parse accounts.
-        for item in config_root.find("accounts").iterfind("account"):
+            if args.worker is None:
+                metrics_json_file = settings["metrics_json_file"]
 
-            name = item.attrib["name"]
-            csv = make_path(item.attrib["csvFile"])
-            user = item.attrib["user"]
-            if item.attrib["passwordType"].upper() == "PLAIN":
-                password = item.attrib["password"]
-            elif item.attrib["passwordType"].upper() == "BASE64":
-                password = base64.b64decode(item.attrib["password"].encode("utf-8")).decode('utf-8')
-            else:
-                raise ValueError("Unknown password type '%s'." % item.attrib["passwordType"])
-            iban = item.attrib["iban"].strip().replace(" ", "")
-            blz = item.attrib["blz"]
-            url = item.attrib["fintsURL"]
+        # Profiling itself is started by SIGUSR1 and SIGUSR2.
+        profiler.rounds = settings["profile_rounds"]
+        profiler.sample_interval = settings["profile_sample_interval"]
 
-            if not os.path.isfile(csv):
-                raise ValueError("No file '%s'." % csv)
+        file_watcher = FileWatcher()
 
-            account = Account(name, user, password, blz, iban, url, csv)
+        # General settings (except the check interval) can only be changed by a restart.
+        general_settings = dict(config_root.find("general").attrib)
+        del general_settings["checkInterval"]
 
-            # Register all events.
-            for event_xml in item.iterfind("event"):
-                event_id = int(event_xml.text)
-                if event_id not in events.keys():
-                    raise ValueError("Event id '%d' does not exist." % event_id)
-                account.register_event(events[event_id])
+        # Join the cluster as worker and check only the accounts this worker is responsible for.
+        if args.worker is not None:
+            cluster_worker = ClusterWorker(args.worker,
+                                           coordinator_url,
+                                           settings["cluster_secret"],
+                                           settings["heartbeat_interval"],
+                                           settings["virtual_nodes"],
+                                           get_worker_status,
+                                           scheduler.wake)
 
-            accounts.append(account)
+        # Parse events and accounts. The first checks start while the remaining rules files are still loading.
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency)
+        checks_started = list()
+        if args.backfill is None and not args.seed:
+            apply_config(config_root, check_interval, lambda: checks_started.append(start_checks(executor)))
+        else:
+            apply_config(config_root, check_interval)
 
     except Exception as e:
         logging.exception("Not able to parse config file.")
         sys.exit(1)
 
+    if args.backfill is not None or args.seed:
+
+        # A backfill is stopped right away, the next run resumes it from the progress in the archive.
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+        try:
+            exit_code = backfill_main(args, max_concurrency, max_concurrency_per_bank)
+        except Exception as e:
+            logging.exception("Not able to backfill accounts.")
+            print(e, file=sys.stderr)
+            exit_code = 1
+        dispatcher.shutdown(1)
+        storage.close()
+        sys.exit(exit_code)
+
+    file_watcher.start()
+
+    cluster_generation = -1
+    if cluster_worker is not None:
+        cluster_worker.start()
+
     # Start monitoring of accounts.
+    checks_finished = any(checks_started)
     while True:
 
-        logging.debug("Starting new processing round.")
+        if cluster_worker is not None and cluster_worker.generation != cluster_generation:
+            cluster_generation = cluster_worker.generation
+            update_assigned_accounts()
 
-        for account in accounts:
-            logging.debug("Checking account '%s' with IBAN '%s'." % (account.name, account.iban))
-            try:
-                account.check()
-                account.clean_up()
-            except Exception as e:
-                logging.exception("Not able to process account '%s' with IBAN '%s'." % (account.name, account.iban))
+        if profile_requested is not None:
+            profiler.start(profile_requested)
+            profile_requested = None
+
+        # Shut down as soon as no check is running (no new checks are started until then).
+        if shutdown_requested:
+            if scheduler.get_num_running() == 0:
+                break
 
-        logging.debug("Waiting %d seconds until next processing round." % check_interval)
-        time.sleep(check_interval)
+        # Apply a changed configuration as soon as no check is running (no new checks are started until then).
+        elif reload_requested:
+            if scheduler.get_num_running() == 0:
+                reload_requested = False
+                reload_config()
+        elif start_checks(executor):
+            checks_finished = True
+
+        # Send notifications collected during the checks as soon as all running checks have finished.
+        if scheduler.get_num_running() == 0:
+            for event in events.values():
+                event.flush()
+
+        if checks_finished and scheduler.get_num_running() == 0:
+            checks_finished = False
+            profiler.finish_round()
+
+            if metrics_json_file is not None:
+                try:
+                    metrics.dump_json(metrics_json_file)
+                except Exception as e:
+                    logging.exception("Not able to write metrics to '%s'.", metrics_json_file)
+
+        # Wait for the next due check, a finished check or the digest window of an event.
+        scheduler.wait(60)
+
+    logging.info("Shutting down threads.")
+    if cluster_worker is not None:
+        cluster_worker.exit()
+    file_watcher.exit()
+    for event in events.values():
+        event.flush(force=True)
+    dispatcher.shutdown(20)
+    executor.shutdown()
+    logging.info("Waiting for threads to exit.")
+    time.sleep(2)
+    sys.exit(0)
@@ -0,0 +1,136 @@
+import datetime
+import threading
+import time
+from decimal import Decimal
+from typing import Dict, List
+
+
+class FakeAmount(object):
+    """
+    Amount of a fake transaction (same attributes as the amount of a mt940 transaction).
+    """
+
+    def __init__(self, amount: Decimal, currency: str):
+        self.amount = amount
+        self.currency = currency
+
+
+class FakeTransaction(object):
+    """
+    Transaction as returned by the FinTS client (only the data used by the banking monitor).
+    """
+
+    def __init__(self,
+                 name: str,
+                 iban: str,
+                 amount: Decimal,
+                 currency: str,
+                 date: datetime.date,
+                 subject: str):
+        self.data = {"currency": currency,
+                     "amount": FakeAmount(amount, currency),
+                     "date": date,
+                     "purpose": subject,
+                     "applicant_name": name,
+                     "applicant_iban": iban}
+
+
+class FakeSepaAccount(object):
+    """
+    SEPA account as returned by the FinTS client.
+    """
+
+    def __init__(self, iban: str):
+        self.iban = iban
+        self.bic = "BENCHDEXXXX"
+
+
+class FakeBank(object):
+    """
+    Local stand-in for a FinTS server that holds synthetic transactions per IBAN.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        """
+
+        :param latency: seconds each request to the fake server takes.
+        """
+        self.latency = latency
+        self._lock = threading.Lock()
+
+        # IBANs of each login and transactions of each IBAN.
+        self._logins = dict()  # type: Dict[str, List[str]]
+        self._transactions = dict()  # type: Dict[str, List[FakeTransaction]]
+
+        # Statistics of the fake server.
+        self.num_logins = 0
+        self.num_requests = 0
+
+    def add_account(self, user: str, iban: str):
+        """
+        Adds an account to the given login.
+
+        :param user: user of the login.
+        :param iban: IBAN of the account.
+        """
+        with self._lock:
+            self._logins.setdefault(user, list()).append(iban)
+            self._transactions.setdefault(iban, list())
+
+    def add_transaction(self, iban: str, transaction: FakeTransaction):
+        """
+        Books a transaction on the given account.
+
+        :param iban: IBAN of the account.
+        :param transaction: transaction to book.
+        """
+        with self._lock:
+            self._transactions[iban].append(transaction)
+
+    def create_client(self, blz: str, user: str, password: str, url: str) -> "FakeFinTSClient":
+        """
+        Creates a client for this fake server (same arguments as FinTS3PinTanClient).
+
+        :return: client object.
+        """
+        with self._lock:
+            self.num_logins += 1
+        return FakeFinTSClient(self, user)
+
+    def request(self):
+        """
+        Simulates the latency of a request to the server.
+        """
+        with self._lock:
+            self.num_requests += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def get_ibans(self, user: str) -> List[str]:
+        with self._lock:
+            return list(self._logins.get(user, list()))
+
+    def get_transactions(self, iban: str, start_date: datetime.date, end_date: datetime.date) -> List[FakeTransaction]:
+        with self._lock:
+            return list(filter(lambda x: start_date <= x.data["date"] <= end_date, self._transactions[iban]))
+
+
+class FakeFinTSClient(object):
+    """
+    Client for the fake FinTS server with the interface of FinTS3PinTanClient used by the banking monitor.
+    """
+
+    def __init__(self, bank: FakeBank, user: str):
+        self._bank = bank
+        self._user = user
+
+    def get_sepa_accounts(self) -> List[FakeSepaAccount]:
+        self._bank.request()
+        return list(map(FakeSepaAccount, self._bank.get_ibans(self._user)))
+
+    def get_transactions(self,
+                         account: FakeSepaAccount,
+                         start_date: datetime.date,
+                         end_date: datetime.date) -> List[FakeTransaction]:
+        self._bank.request()
+        return self._bank.get_transactions(account.iban, start_date, end_date)
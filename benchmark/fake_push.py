@@ -0,0 +1,35 @@
+import threading
+import time
+from lib import EventDispatcher
+from lib.event import Event
+from lib.transaction import SimpleTransaction
+
+
+class FakePushEvent(Event):
+    """
+    Event that counts the notifications instead of sending them to a push server.
+    """
+
+    def __init__(self, id: int, dispatcher: EventDispatcher, latency: float = 0.0):
+        """
+
+        :param id: id of the event.
+        :param dispatcher: dispatcher that sends the notifications of the event.
+        :param latency: seconds sending a notification takes.
+        """
+        super().__init__(id, dispatcher)
+        self.latency = latency
+        self._lock = threading.Lock()
+        self.num_triggered = 0
+        self.num_sent = 0
+
+    def _send(self):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        with self._lock:
+            self.num_sent += 1
+
+    def trigger(self, account, transaction: SimpleTransaction):
+        with self._lock:
+            self.num_triggered += 1
+        self.dispatcher.submit(self._send, "benchmark")
@@ -0,0 +1,92 @@
+import calendar
+import csv
+import datetime
+import random
+from decimal import Decimal
+from typing import List, Tuple
+from .fake_backend import FakeTransaction
+
+# Columns of a generated rule (description, IBAN, amount, currency, start day, end day).
+RuleRow = Tuple[str, str, Decimal, str, int, int]
+
+CURRENCIES = ["EUR", "EUR", "EUR", "USD", "CHF"]
+
+
+def generate_iban(rng: random.Random) -> str:
+    """
+    Generates a random German looking IBAN.
+
+    :param rng: random number generator.
+    :return: IBAN string.
+    """
+    return "DE%02d%018d" % (rng.randint(10, 99), rng.randint(0, 10 ** 18 - 1))
+
+
+def generate_amount(rng: random.Random) -> Decimal:
+    """
+    Generates a random amount with two decimal places.
+
+    :param rng: random number generator.
+    :return: amount.
+    """
+    return Decimal(rng.randint(-200000, 200000)) / 100
+
+
+def generate_rules(rng: random.Random, num_rules: int, today: datetime.date) -> List[RuleRow]:
+    """
+    Generates rules whose time frames contain the given day.
+
+    :param rng: random number generator.
+    :param num_rules: number of rules to generate.
+    :param today: day the time frames have to contain.
+    :return: list of rules.
+    """
+    last_day = calendar.monthrange(today.year, today.month)[1]
+    rules = list()
+    for i in range(num_rules):
+        rules.append(("Generated rule %d" % i,
+                      generate_iban(rng),
+                      generate_amount(rng),
+                      rng.choice(CURRENCIES),
+                      rng.randint(1, today.day),
+                      rng.randint(today.day, last_day)))
+    return rules
+
+
+def write_rules_csv(file_location: str, rules: List[RuleRow]):
+    """
+    Writes the given rules as csv file in the format of the banking monitor.
+
+    :param file_location: file location of the csv file.
+    :param rules: list of rules.
+    """
+    with open(file_location, 'w', newline="") as fp:
+        csv_writer = csv.writer(fp, quoting=csv.QUOTE_MINIMAL)
+        csv_writer.writerow(["Description", "IBAN", "Amount", "Currency", "Start Day", "End Day"])
+        for rule in rules:
+            csv_writer.writerow([rule[0], rule[1], str(rule[2]), rule[3], rule[4], rule[5]])
+
+
+def generate_transaction(rng: random.Random,
+                         rules: List[RuleRow],
+                         date: datetime.date,
+                         whitelisted_ratio: float) -> FakeTransaction:
+    """
+    Generates a transaction that is either whitelisted by one of the given rules or unknown.
+
+    :param rng: random number generator.
+    :param rules: rules of the account.
+    :param date: date of the transaction.
+    :param whitelisted_ratio: probability that the transaction is whitelisted.
+    :return: transaction.
+    """
+    subject = "Generated subject %d" % rng.randint(0, 10 ** 9)
+    if rules and rng.random() < whitelisted_ratio:
+        rule = rng.choice(rules)
+        return FakeTransaction("Known recipient", rule[1], rule[2], rule[3], date, subject)
+    return FakeTransaction("Unknown recipient",
+                           generate_iban(rng),
+                           generate_amount(rng),
+                           rng.choice(CURRENCIES),
+                           date,
+                           subject)
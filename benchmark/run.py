@@ -0,0 +1,230 @@
+#!/usr/bin/python3
+"""
+End-to-end benchmark of the monitoring loop against a local fake FinTS server and push sink.
+
+Usage (from the repository root): python3 -m benchmark.run [options]
+"""
+import argparse
+import concurrent.futures
+import datetime
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List
+from lib import Account, EventDispatcher, FinTSSession, Rules, Storage
+from lib.transaction import SimpleTransaction
+from .fake_backend import FakeBank
+from .fake_push import FakePushEvent
+from .generator import generate_iban, generate_rules, generate_transaction, write_rules_csv
+
+# Metrics compared against the baseline and whether a higher value is better.
+METRICS = {"rounds_per_second": True,
+           "account_latency_p50_ms": False,
+           "account_latency_p99_ms": False,
+           "rule_matches_per_second": True,
+           "peak_rss_kb": False}
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """
+    Gets the percentile of the given values (nearest rank).
+
+    :param values: list of values.
+    :param percent: percentile between 0 and 100.
+    :return: value of the percentile.
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = max(int(round(percent / 100.0 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def check_account(account: Account) -> float:
+    """
+    Checks a single account like the processing round of the daemon does.
+
+    :param account: account to check.
+    :return: seconds the check took.
+    """
+    start = time.perf_counter()
+    try:
+        account.check()
+        account.clean_up()
+    except Exception as e:
+        logging.exception("Not able to process account '%s'.", account.name)
+    return time.perf_counter() - start
+
+
+def check_session_accounts(session_accounts: List[Account]) -> List[float]:
+    return list(map(check_account, session_accounts))
+
+
+def run(args: argparse.Namespace, work_dir: str) -> Dict[str, float]:
+    """
+    Runs the benchmark.
+
+    :param args: command line arguments.
+    :param work_dir: directory for the generated files.
+    :return: dictionary of measured metrics.
+    """
+    rng = random.Random(args.seed)
+    today = datetime.date.today()
+
+    bank = FakeBank(args.bank_latency / 1000.0)
+    dispatcher = EventDispatcher(num_workers=2, queue_size=100000)
+    dispatcher.start()
+    event = FakePushEvent(0, dispatcher, args.push_latency / 1000.0)
+    storage = Storage(os.path.join(work_dir, "state.db"))
+
+    # Generate accounts with their rules and initial transactions.
+    accounts = list()
+    account_rules = dict()
+    sessions = dict()
+    for i in range(args.accounts):
+        user = "user%d" % (i // args.accounts_per_login)
+        if user not in sessions.keys():
+            sessions[user] = FinTSSession(user, "password", "12345678", "https://fints.invalid/%s" % user,
+                                          client_factory=bank.create_client)
+        iban = generate_iban(rng)
+        bank.add_account(user, iban)
+
+        rules = generate_rules(rng, args.rules, today)
+        csv_file = os.path.join(work_dir, "rules_%d.csv" % i)
+        write_rules_csv(csv_file, rules)
+
+        account = Account("Account %d" % i, sessions[user], iban, Rules(csv_file), storage)
+        account.register_event(event)
+        accounts.append(account)
+        account_rules[account] = rules
+
+        for _ in range(args.transactions):
+            bank.add_transaction(iban, generate_transaction(rng, rules, today, args.whitelisted))
+
+    groups = dict()
+    for account in accounts:
+        groups.setdefault(account.session, list()).append(account)
+
+    # Run processing rounds with new transactions booked before each round.
+    latencies = list()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency)
+    rounds_start = time.perf_counter()
+    for round_num in range(args.rounds):
+        if round_num > 0:
+            for account in accounts:
+                for _ in range(args.new_transactions):
+                    bank.add_transaction(account.iban,
+                                         generate_transaction(rng, account_rules[account], today, args.whitelisted))
+
+        for group_latencies in executor.map(check_session_accounts, groups.values()):
+            latencies.extend(group_latencies)
+    rounds_duration = time.perf_counter() - rounds_start
+    executor.shutdown()
+    dispatcher.shutdown(60)
+
+    # Measure the rule matching separately from the bank communication.
+    samples = list()
+    for account in accounts:
+        for transaction in bank.get_transactions(account.iban, today, today):
+            samples.append((account.rules, SimpleTransaction(transaction.data["applicant_name"],
+                                                             transaction.data["applicant_iban"],
+                                                             transaction.data["amount"].amount,
+                                                             transaction.data["currency"],
+                                                             transaction.data["date"],
+                                                             transaction.data["purpose"])))
+    num_matches = 0
+    matches_start = time.perf_counter()
+    while True:
+        for rules, transaction in samples:
+            rules.check_allowed(transaction)
+        num_matches += len(samples)
+        matches_duration = time.perf_counter() - matches_start
+        if not samples or matches_duration >= args.match_duration:
+            break
+
+    storage.close()
+
+    return {"rounds_per_second": args.rounds / rounds_duration,
+            "account_latency_p50_ms": percentile(latencies, 50) * 1000.0,
+            "account_latency_p99_ms": percentile(latencies, 99) * 1000.0,
+            "rule_matches_per_second": num_matches / matches_duration if matches_duration > 0 else 0.0,
+            "peak_rss_kb": float(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss),
+            "bank_logins": float(bank.num_logins),
+            "bank_requests": float(bank.num_requests),
+            "notifications_triggered": float(event.num_triggered),
+            "notifications_sent": float(event.num_sent)}
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float]) -> bool:
+    """
+    Prints the results compared to the baseline.
+
+    :param results: measured metrics.
+    :param baseline: metrics of the baseline.
+    :return: True if no metric regressed by more than the tolerance.
+    """
+    ok = True
+    print("%-26s %16s %16s %9s" % ("metric", "baseline", "current", "change"))
+    for metric, higher_is_better in METRICS.items():
+        old = baseline["results"].get(metric)
+        new = results[metric]
+        if not old:
+            print("%-26s %16s %16.2f" % (metric, "-", new))
+            continue
+        change = (new - old) / old * 100.0
+        regressed = (change < -baseline["tolerance"]) if higher_is_better else (change > baseline["tolerance"])
+        print("%-26s %16.2f %16.2f %+8.1f%%%s" % (metric, old, new, change, " REGRESSION" if regressed else ""))
+        ok = ok and not regressed
+    return ok
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Benchmark of the banking monitor processing rounds.")
+    parser.add_argument("--accounts", type=int, default=50, help="number of accounts")
+    parser.add_argument("--accounts-per-login", type=int, default=1, help="number of accounts sharing a login")
+    parser.add_argument("--transactions", type=int, default=100, help="initial transactions per account")
+    parser.add_argument("--new-transactions", type=int, default=5, help="new transactions per account and round")
+    parser.add_argument("--rules", type=int, default=1000, help="rules per account")
+    parser.add_argument("--whitelisted", type=float, default=0.8, help="ratio of whitelisted transactions")
+    parser.add_argument("--rounds", type=int, default=10, help="number of processing rounds")
+    parser.add_argument("--concurrency", type=int, default=4, help="number of concurrently checked logins")
+    parser.add_argument("--bank-latency", type=float, default=0.0, help="latency of a bank request in ms")
+    parser.add_argument("--push-latency", type=float, default=0.0, help="latency of a notification in ms")
+    parser.add_argument("--match-duration", type=float, default=2.0, help="seconds to measure rule matching")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generated data")
+    parser.add_argument("--baseline", default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                           "baseline.json"),
+                        help="file location of the baseline")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as new baseline")
+    parser.add_argument("--tolerance", type=float, default=10.0, help="allowed regression in percent")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s %(levelname)s: %(message)s", level=logging.ERROR)
+
+    work_dir = tempfile.mkdtemp(prefix="banking_monitor_benchmark_")
+    try:
+        results = run(args, work_dir)
+    finally:
+        shutil.rmtree(work_dir)
+
+    for metric, value in results.items():
+        print("%-26s %16.2f" % (metric, value))
+    print()
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as fp:
+            json.dump({"parameters": vars(args), "tolerance": args.tolerance, "results": results}, fp, indent=4)
+        print("Stored baseline in '%s'." % args.baseline)
+
+    elif os.path.isfile(args.baseline):
+        with open(args.baseline, 'r') as fp:
+            baseline = json.load(fp)
+        if not compare(results, baseline):
+            sys.exit(1)
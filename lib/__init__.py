@@ -1,3 +1,17 @@
 from .transaction import SimpleTransaction, AllowedTransaction
+from .metrics import Metrics, MetricsServer, metrics
+from .profiler import Profiler, profiler
+from .log import RotatingLogFileHandler, JsonLogFormatter, setup_logging
+from .rules import Rules
+from .archive import TRANSACTION_FIELDS, Archive, CsvArchive, SqliteArchive, open_archive
+from .replay import read_transactions, replay
+from .watcher import FileWatcher
+from .ratelimit import RateLimiter, RateLimitExceeded
+from .session import FinTSSession
+from .scheduler import Scheduler
+from .storage import Storage
 from .account import Account
-from .event import EventLightweightPush
\ No newline at end of file
+from .backfill import Backfill
+from .cluster import HashRing, ClusterCoordinator, ClusterWorker
+from .dispatcher import EventDispatcher, TransientEventError
+from .event import Event, EventLightweightPush
\ No newline at end of file
@@ -1,9 +1,12 @@
-from fints.client import FinTS3PinTanClient
 from .rules import Rules
+from .session import FinTSSession
+from .storage import Storage
 from .transaction import SimpleTransaction
 from .event import Event
+from .metrics import metrics
 import datetime
 import logging
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 
 
 class Account(object):
@@ -11,71 +14,189 @@ class Account(object):
     Manages one account that is monitored.
     """
 
-    def __init__(self, name: str, user: str, password: str, blz: str, iban: str, url: str, csv_file: str):
+    def __init__(self,
+                 name: str,
+                 session: FinTSSession,
+                 iban: str,
+                 rules: Rules,
+                 storage: Storage,
+                 overlap_days: int = 2):
         """
 
         :param name: name of this account.
-        :param user: user used to login to the bank.
-        :param password: password used to login to the bank
-        :param blz: blz of this account (used in Germany, do not know what banks outside Germany use here)
+        :param session: FinTS session of the bank login used for this account.
         :param iban: iban of the account.
-        :param url: url to the FinTS access point.
-        :param csv_file: file location of the rules for this account for whitelisted transactions.
+        :param rules: rules for this account for whitelisted transactions.
+        :param storage: storage used to persist the state of this account.
+        :param overlap_days: number of days before the high-water mark that are fetched again.
         """
         self.name = name
-        self.user = user
-        self.password = password
-        self.blz = blz
+        self.session = session
         self.iban = iban.strip().replace(" ", "").upper()
-        self.url = url
+        self.storage = storage
+        self.overlap_days = overlap_days
 
-        # The transactions of the last x days are fetched from the server.
+        # The transactions of the last x days are fetched from the server on the first check.
         self.delta_days = 5
 
-        # Start rules daemon.
-        self.rules = Rules(csv_file)
-        self.rules.daemon = True
-        self.rules.start()
+        # High-water mark of the last check (last fetched date and fingerprints of the transactions on that date).
+        self.hwm_date = None  # type: Optional[datetime.date]
+        self.hwm_fingerprints = set()  # type: Set[str]
+        self.rules = rules
+        self.load_state()
 
-        # A set of transactions that already triggered an event.
-        self.triggered_transactions = set()
+        # Day on which the triggered transactions in the storage were cleaned up the last time.
+        self._clean_up_date = None  # type: Optional[datetime.date]
 
         # List of events that are triggered when an unknown transaction is discovered.
         self.events = list()
 
-    def exit(self):
+    def load_state(self):
         """
-        Exits the threads of the account object.
+        Loads the state of this account from the storage (e.g., when the account is taken over from another worker).
         """
+        self.hwm_date, self.hwm_fingerprints = self.storage.get_high_water_mark(self.iban)
 
-        self.rules.exit()
+        # Fingerprints by raw record of the fetched transactions that were already decided (triggered, seen or
+        # whitelisted) bucketed by their date. Only valid for the rules generation they were decided with.
+        self._decided = dict()  # type: Dict[datetime.date, Dict[Tuple, str]]
+        self._decided_generation = self.rules.generation
+
+    @property
+    def url(self) -> str:
+        """
+        URL to the FinTS access point of this account.
+        """
+        return self.session.url
 
     def check(self):
         """
         Fetches the last transactions from the account and checks if they are unknown.
         """
 
-        fints_client = FinTS3PinTanClient(self.blz, self.user, self.password, self.url)
-        accounts = fints_client.get_sepa_accounts()
+        # Get all transactions since the last check (or from the last 5 days on the first check).
+        # The days before the high-water mark are fetched again to get transactions booked late.
+        end_date = datetime.date.today()
+        if self.hwm_date is None:
+            start_date = end_date - datetime.timedelta(days=self.delta_days)
+        else:
+            start_date = min(self.hwm_date, end_date) - datetime.timedelta(days=self.overlap_days)
+        transactions = self.session.get_transactions(self.iban,
+                                                     start_date,
+                                                     end_date)
 
-        # Extract account.
-        account = None
-        for temp_account in accounts:
-            if temp_account.iban.upper() == self.iban:
-                account = temp_account
-                break
-        if account is None:
-            raise ValueError("Account '%s' with IBAN '%s' not found." % (self.name, self.iban))
+        metrics.add(self.iban, "transactions_fetched", len(transactions))
 
-        # Get all transaction from the last 5 days.
-        start_date = datetime.date.today() - datetime.timedelta(days=self.delta_days)
-        transactions = fints_client.get_transactions(account,
-                                                     start_date,
-                                                     datetime.date.today())
+        # Decisions made with rules that changed in the meantime have to be made again.
+        if self._decided_generation != self.rules.generation:
+            self._decided = dict()
+            self._decided_generation = self.rules.generation
+
+        # Days before the fetched range are not fetched again.
+        for date in list(self._decided.keys()):
+            if date < start_date:
+                del self._decided[date]
+
+        # Skip the transactions already decided in a previous check before converting them.
+        end_date_fingerprints = set()
+        undecided = list()
+        raw_keys = list()
+        with metrics.phase(self.iban, "conversion"):
+            for transaction in transactions:
+                date, raw_key = self._get_raw_key(transaction)
+                fingerprint = self._decided.get(date, dict()).get(raw_key)
+                if fingerprint is None:
+                    undecided.append(transaction)
+                    raw_keys.append((date, raw_key))
+                elif date == end_date:
+                    end_date_fingerprints.add(fingerprint)
+
+            simple_transactions = self.convert_transactions(undecided)
+
+        metrics.add(self.iban, "transactions_cached", len(transactions) - len(undecided))
+
+        if not simple_transactions:
+            self._update_high_water_mark(end_date, end_date_fingerprints)
+            return
+
+        # Get all transactions of the fetched days that already triggered an event at once.
+        triggered = self.storage.get_triggered(self.iban,
+                                               min(map(lambda x: x.date, simple_transactions)),
+                                               max(map(lambda x: x.date, simple_transactions)))
+
+        new_triggered = list()
+        num_seen = 0
+        with metrics.phase(self.iban, "rules"):
+            for obj in simple_transactions:
+                fingerprint = obj.get_fingerprint()
+                if obj.date == end_date:
+                    end_date_fingerprints.add(fingerprint)
+
+                # Skip transactions already processed on the day of the high-water mark.
+                if obj.date == self.hwm_date and fingerprint in self.hwm_fingerprints:
+                    num_seen += 1
+                    continue
+
+                if fingerprint in triggered:
+                    num_seen += 1
+                    continue
+
+                if not self.rules.check_allowed(obj):
+                    triggered.add(fingerprint)
+                    new_triggered.append((obj, fingerprint))
+
+        metrics.add(self.iban, "transactions_whitelisted", len(simple_transactions) - num_seen - len(new_triggered))
+
+        # Store the transactions before triggering the events to never send a notification twice. Transactions
+        # claimed by another worker sharing the storage in the meantime are skipped.
+        claimed = self.storage.claim_triggered(self.iban, map(lambda x: (x[0].date, x[1]), new_triggered))
+
+        metrics.add(self.iban, "transactions_seen", num_seen + len(new_triggered) - len(claimed))
+        metrics.add(self.iban, "transactions_triggered", len(claimed))
+
+        for obj, fingerprint in new_triggered:
+            if fingerprint not in claimed:
+                continue
+
+            logging.debug("Transaction '%s' not whitelisted. Triggering event.", obj)
+
+            # Trigger events.
+            for event in self.events:
+                event.trigger(self, obj)
+
+        # All transactions are decided now and do not have to be converted or matched again.
+        for obj, (date, raw_key) in zip(simple_transactions, raw_keys):
+            self._decided.setdefault(date, dict())[raw_key] = obj.get_fingerprint()
+
+        self._update_high_water_mark(end_date, end_date_fingerprints)
 
+    @staticmethod
+    def _get_raw_key(transaction: Any) -> Tuple[Any, Tuple]:
+        """
+        Gets a key identifying a transaction fetched from the bank without converting it.
+
+        :param transaction: transaction as returned by the FinTS client.
+        :return: tuple of the date of the transaction and its key.
+        """
+        data = transaction.data
+        return data["date"], (data["amount"].amount,
+                              data["currency"],
+                              data["purpose"],
+                              data["applicant_name"],
+                              data["applicant_iban"])
+
+    def convert_transactions(self, transactions: List[Any]) -> List[SimpleTransaction]:
+        """
+        Converts the transactions fetched from the bank into simplified transaction objects.
+
+        :param transactions: transactions as returned by the FinTS client.
+        :return: list of simplified transactions.
+        """
+
+        simple_transactions = list()
         for transaction in transactions:
             currency = str(transaction.data["currency"])
-            amount = float(transaction.data["amount"].amount)
+            amount = transaction.data["amount"].amount
             date = transaction.data["date"]
             if not isinstance(date, datetime.date):
                 raise ValueError("Account '%s' with IBAN '%s' contains "
@@ -91,31 +212,83 @@ class Account(object):
                                     date,
                                     subject)
 
-            if obj in self.triggered_transactions:
-                continue
+            simple_transactions.append(obj)
+        return simple_transactions
 
-            if not self.rules.check_allowed(obj):
+    def _update_high_water_mark(self, date: datetime.date, fingerprints: Set[str]):
+        """
+        Moves the high-water mark to the given date and stores it.
 
-                logging.debug("Transaction '%s' not whitelisted. Triggering event." % str(obj))
+        :param date: last fetched date.
+        :param fingerprints: fingerprints of the transactions fetched for the given date.
+        """
+        if self.hwm_date == date:
+            fingerprints |= self.hwm_fingerprints
+        self.hwm_date = date
+        self.hwm_fingerprints = fingerprints
+        self.storage.set_high_water_mark(self.iban, self.hwm_date, self.hwm_fingerprints)
 
-                # Trigger events.
-                for event in self.events:
-                    event.trigger(self, obj)
+    def _get_oldest_kept_date(self, today: datetime.date) -> datetime.date:
+        """
+        Gets the oldest day for which triggered transactions are kept in the storage.
 
-                self.triggered_transactions.add(obj)
+        :param today: current day.
+        :return: oldest kept day.
+        """
+        return today - datetime.timedelta(days=(max(self.delta_days, self.overlap_days) + 10))
+
+    def seed(self, transactions: Iterable[SimpleTransaction], end_date: datetime.date) -> int:
+        """
+        Marks archived transactions as processed so that they do not trigger an event on the next check,
+        and moves the high-water mark to the end of the archive so that the next check continues from there.
+
+        :param transactions: archived transactions of this account.
+        :param end_date: last day the archived transactions are complete for.
+        :return: number of transactions that are not whitelisted and were marked as triggered.
+        """
+
+        # Only the days that are fetched again by the next check or are kept in the storage matter.
+        today = datetime.date.today()
+        end_date = min(end_date, today)
+        start_date = min(self._get_oldest_kept_date(today), end_date - datetime.timedelta(days=self.overlap_days))
+
+        end_date_fingerprints = set()
+        seeded = list()
+        for obj in transactions:
+            if not (start_date <= obj.date <= end_date):
+                continue
+            if obj.date == end_date:
+                end_date_fingerprints.add(obj.get_fingerprint())
+            seeded.append(obj)
+
+        # Check all archived transactions against the rules at once.
+        new_triggered = list()
+        for obj, is_allowed in zip(seeded, self.rules.check_allowed_many(seeded)):
+            if not is_allowed:
+                new_triggered.append((obj.date, obj.get_fingerprint()))
+
+        self.storage.add_triggered(self.iban, new_triggered)
+        if self.hwm_date is None or self.hwm_date <= end_date:
+            self._update_high_water_mark(end_date, end_date_fingerprints)
+        return len(new_triggered)
 
     def clean_up(self):
         """
         Cleans up the account object (e.g., deletes old processed transactions).
         """
 
-        oldest_date = datetime.date.today() - datetime.timedelta(days=(self.delta_days + 10))
-        for obj in list(self.triggered_transactions):
-            if obj.date < oldest_date:
+        # Triggered transactions are bucketed by day, hence they only have to be cleaned up once a day.
+        today = datetime.date.today()
+        if self._clean_up_date == today:
+            return
+
+        oldest_date = self._get_oldest_kept_date(today)
 
-                logging.debug("Removing '%s' from triggered list." % str(obj))
+        logging.debug("Removing triggered transactions before %s of account '%s' with IBAN '%s'.",
+                      oldest_date, self.name, self.iban)
 
-                self.triggered_transactions.remove(obj)
+        self.storage.remove_triggered_before(self.iban, oldest_date)
+        self._clean_up_date = today
 
     def register_event(self, event: Event):
         """
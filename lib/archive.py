@@ -0,0 +1,248 @@
+import csv
+import datetime
+import decimal
+import json
+import os
+import sqlite3
+from .transaction import SimpleTransaction
+from typing import Iterable, Iterator, Optional
+
+# Fields of a recorded transaction (the fields of a SimpleTransaction).
+TRANSACTION_FIELDS = ("date", "name", "iban", "amount", "currency", "subject")
+
+
+def create_transaction(record: dict) -> SimpleTransaction:
+    """
+    Creates a transaction object from a recorded transaction.
+
+    :param record: dictionary with the transaction fields.
+    :return: transaction object.
+    """
+    try:
+        date = datetime.date.fromisoformat(record["date"])
+        return SimpleTransaction(record["name"],
+                                 record["iban"],
+                                 str(record["amount"]).strip().replace(",", "."),
+                                 record["currency"],
+                                 date,
+                                 record["subject"])
+    except KeyError as e:
+        raise ValueError("Missing field %s." % str(e))
+    except (AttributeError, TypeError):
+        raise ValueError("Invalid record.")
+    except ArithmeticError:
+        raise ValueError("Invalid amount '%s'." % record["amount"])
+
+
+class Archive(object):
+    """
+    Local archive of the transactions of the monitored accounts. It remembers up to which day
+    the transactions of each account are archived to be able to resume an interrupted backfill.
+    """
+
+    def get_progress(self, account: str) -> Optional[datetime.date]:
+        """
+        Gets the last day up to which the transactions of the given account are archived.
+
+        :param account: key of the account.
+        :return: last archived day (None if nothing is archived).
+        """
+        raise NotImplementedError("Abstract class.")
+
+    def write(self, account: str, end_date: datetime.date, transactions: Iterable[SimpleTransaction]):
+        """
+        Archives the transactions of the given account and atomically moves its progress to the given day.
+
+        :param account: key of the account.
+        :param end_date: last day the transactions are complete for.
+        :param transactions: transactions to archive.
+        """
+        raise NotImplementedError("Abstract class.")
+
+    def read(self,
+             account: Optional[str] = None,
+             start_date: Optional[datetime.date] = None) -> Iterator[SimpleTransaction]:
+        """
+        Reads the archived transactions one by one.
+
+        :param account: key of the account (None for all accounts).
+        :param start_date: first day of the transactions to read (None for all days).
+        :return: iterator of transaction objects.
+        """
+        raise NotImplementedError("Abstract class.")
+
+    def close(self):
+        """
+        Closes the archive.
+        """
+        pass
+
+
+class CsvArchive(Archive):
+    """
+    Archive stored as csv file with an account column followed by the transaction fields. The
+    progress is stored next to it and contains the size of the csv file at the last write, which
+    allows to drop a partially written chunk when an interrupted backfill is resumed.
+    """
+
+    def __init__(self, file_location: str):
+        """
+
+        :param file_location: file location of the csv file.
+        """
+        self.file_location = file_location
+        self.progress_location = file_location + ".progress"
+
+        self._size = 0
+        self._progress = dict()
+        if os.path.isfile(self.progress_location):
+            with open(self.progress_location, 'r') as fp:
+                data = json.load(fp)
+            self._size = data["size"]
+            self._progress = data["accounts"]
+
+        elif os.path.isfile(self.file_location) and os.path.getsize(self.file_location) > 0:
+            raise ValueError("File '%s' is not a transaction archive (no file '%s')."
+                             % (self.file_location, self.progress_location))
+
+        self._fp = open(self.file_location, 'a+', newline="")
+        if self._fp.tell() > self._size:
+            self._fp.truncate(self._size)
+        self._writer = csv.writer(self._fp)
+        if self._size == 0:
+            self._writer.writerow(("account", ) + TRANSACTION_FIELDS)
+            self._commit()
+
+    def get_progress(self, account: str) -> Optional[datetime.date]:
+        if account not in self._progress.keys():
+            return None
+        return datetime.date.fromisoformat(self._progress[account])
+
+    def write(self, account: str, end_date: datetime.date, transactions: Iterable[SimpleTransaction]):
+        for obj in transactions:
+            self._writer.writerow((account,
+                                   obj.date.strftime("%Y-%m-%d"),
+                                   obj.name,
+                                   obj.iban,
+                                   str(obj.amount),
+                                   obj.currency,
+                                   obj.subject))
+        self._progress[account] = end_date.strftime("%Y-%m-%d")
+        self._commit()
+
+    def _commit(self):
+        """
+        Flushes the written rows and stores the progress together with the current size of the csv file.
+        """
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+        self._size = self._fp.tell()
+
+        # Replace progress file atomically to never end up with a partially written one.
+        temp_location = self.progress_location + ".tmp"
+        with open(temp_location, 'w') as fp:
+            json.dump({"size": self._size, "accounts": self._progress}, fp)
+        os.replace(temp_location, self.progress_location)
+
+    def read(self,
+             account: Optional[str] = None,
+             start_date: Optional[datetime.date] = None) -> Iterator[SimpleTransaction]:
+        self._fp.flush()
+        with open(self.file_location, 'r', newline="") as fp:
+            for record in csv.DictReader(fp):
+                if account is not None and record["account"] != account:
+                    continue
+                obj = create_transaction(record)
+                if start_date is not None and obj.date < start_date:
+                    continue
+                yield obj
+
+    def close(self):
+        self._fp.close()
+
+
+class SqliteArchive(Archive):
+    """
+    Archive stored in a sqlite database. Transactions are stored once per account (identified by
+    their fingerprint), hence chunks that are fetched again do not create duplicates.
+    """
+
+    def __init__(self, file_location: str):
+        """
+
+        :param file_location: file location of the sqlite database.
+        """
+        self.file_location = file_location
+        self._conn = sqlite3.connect(file_location)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS transactions ("
+                           + "account TEXT NOT NULL, "
+                           + "date TEXT NOT NULL, "
+                           + "fingerprint TEXT NOT NULL, "
+                           + "name TEXT NOT NULL, "
+                           + "iban TEXT NOT NULL, "
+                           + "cents INTEGER NOT NULL, "
+                           + "currency TEXT NOT NULL, "
+                           + "subject TEXT NOT NULL, "
+                           + "PRIMARY KEY (account, date, fingerprint)) WITHOUT ROWID")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS progress ("
+                           + "account TEXT PRIMARY KEY, "
+                           + "date TEXT NOT NULL)")
+        self._conn.commit()
+
+    def get_progress(self, account: str) -> Optional[datetime.date]:
+        row = self._conn.execute("SELECT date FROM progress WHERE account = ?", (account, )).fetchone()
+        if row is None:
+            return None
+        return datetime.date.fromisoformat(row[0])
+
+    def write(self, account: str, end_date: datetime.date, transactions: Iterable[SimpleTransaction]):
+        with self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO transactions "
+                                   + "(account, date, fingerprint, name, iban, cents, currency, subject) "
+                                   + "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                   map(lambda x: (account,
+                                                  x.date.strftime("%Y-%m-%d"),
+                                                  x.get_fingerprint(),
+                                                  x.name,
+                                                  x.iban,
+                                                  x.cents,
+                                                  x.currency,
+                                                  x.subject),
+                                       transactions))
+            self._conn.execute("INSERT OR REPLACE INTO progress (account, date) VALUES (?, ?)",
+                               (account, end_date.strftime("%Y-%m-%d")))
+
+    def read(self,
+             account: Optional[str] = None,
+             start_date: Optional[datetime.date] = None) -> Iterator[SimpleTransaction]:
+        start_str = start_date.strftime("%Y-%m-%d") if start_date is not None else ""
+        if account is None:
+            cursor = self._conn.execute("SELECT name, iban, cents, currency, date, subject FROM transactions "
+                                        + "WHERE date >= ? ORDER BY account, date",
+                                        (start_str, ))
+        else:
+            cursor = self._conn.execute("SELECT name, iban, cents, currency, date, subject FROM transactions "
+                                        + "WHERE account = ? AND date >= ? ORDER BY date",
+                                        (account, start_str))
+        for row in cursor:
+            yield SimpleTransaction(row[0],
+                                    row[1],
+                                    decimal.Decimal(row[2]).scaleb(-2),
+                                    row[3],
+                                    datetime.date.fromisoformat(row[4]),
+                                    row[5])
+
+    def close(self):
+        self._conn.close()
+
+
+def open_archive(file_location: str) -> Archive:
+    """
+    Opens the archive stored at the given location.
+
+    :param file_location: file location of the archive (sqlite if it ends with .db, .sqlite or .sqlite3, else csv).
+    :return: archive object.
+    """
+    if file_location.lower().endswith((".db", ".sqlite", ".sqlite3")):
+        return SqliteArchive(file_location)
+    return CsvArchive(file_location)
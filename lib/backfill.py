@@ -0,0 +1,175 @@
+from .account import Account
+from .archive import Archive
+from .ratelimit import RateLimitExceeded
+from .transaction import SimpleTransaction
+import concurrent.futures
+import datetime
+import logging
+import queue
+import threading
+from typing import Dict, Iterator, List, Tuple
+
+
+def iter_chunks(start_date: datetime.date,
+                end_date: datetime.date,
+                chunk_days: int) -> Iterator[Tuple[datetime.date, datetime.date]]:
+    """
+    Splits the given date range into consecutive chunks.
+
+    :param start_date: first day of the range.
+    :param end_date: last day of the range.
+    :param chunk_days: number of days of a chunk.
+    :return: iterator of tuples of the first and the last day of each chunk.
+    """
+    chunk_start = start_date
+    while chunk_start <= end_date:
+        chunk_end = min(chunk_start + datetime.timedelta(days=chunk_days - 1), end_date)
+        yield chunk_start, chunk_end
+        chunk_start = chunk_end + datetime.timedelta(days=1)
+
+
+class Backfill(object):
+    """
+    Fetches the transactions of a long date range in chunks from the banks and streams them into an archive.
+    The accounts are fetched concurrently while the archive is written by the calling thread only. Fetched
+    chunks are passed on through a bounded queue, hence the memory usage does not depend on the date range.
+    """
+
+    def __init__(self,
+                 archive: Archive,
+                 chunk_days: int = 30,
+                 max_concurrency: int = 4,
+                 max_concurrency_per_bank: int = 1,
+                 queue_size: int = 16):
+        """
+
+        :param archive: archive the transactions are written to.
+        :param chunk_days: number of days fetched with one request.
+        :param max_concurrency: maximum number of accounts fetched concurrently.
+        :param max_concurrency_per_bank: maximum number of concurrent requests per FinTS URL.
+        :param queue_size: maximum number of fetched chunks waiting to be archived.
+        """
+        if chunk_days <= 0:
+            raise ValueError("Chunk days have to be larger than 0.")
+        self.archive = archive
+        self.chunk_days = chunk_days
+        self.max_concurrency = max_concurrency
+        self.max_concurrency_per_bank = max_concurrency_per_bank
+
+        self._queue = queue.Queue(queue_size)
+        self._abort = threading.Event()
+        self._bank_semaphores = dict()  # type: Dict[str, threading.BoundedSemaphore]
+
+    def _fetch_chunks(self,
+                      account: Account,
+                      start_date: datetime.date,
+                      end_date: datetime.date) -> Iterator[Tuple[datetime.date, List[SimpleTransaction]]]:
+        """
+        Fetches the transactions of the given account chunk by chunk.
+
+        :param account: account to fetch.
+        :param start_date: first day to fetch.
+        :param end_date: last day to fetch.
+        :return: iterator of tuples of the last day of the chunk and its transactions.
+        """
+        for chunk_start, chunk_end in iter_chunks(start_date, end_date, self.chunk_days):
+            logging.debug("Fetching transactions from %s to %s of account '%s' with IBAN '%s'.",
+                          chunk_start, chunk_end, account.name, account.iban)
+            while True:
+                try:
+                    with self._bank_semaphores[account.url]:
+                        transactions = account.session.get_transactions(account.iban, chunk_start, chunk_end)
+                    break
+
+                # Wait for the rate limit of the bank instead of giving up the account.
+                except RateLimitExceeded as e:
+                    logging.info("%s Waiting %d seconds to continue backfill of account '%s' with IBAN '%s'.",
+                                 e, e.retry_after, account.name, account.iban)
+                    if self._abort.wait(e.retry_after):
+                        return
+            yield chunk_end, account.convert_transactions(transactions)
+
+    def _put(self, item: Tuple) -> bool:
+        """
+        Passes the given item to the archiving thread.
+
+        :param item: item to pass on.
+        :return: False if the backfill was aborted.
+        """
+        while not self._abort.is_set():
+            try:
+                self._queue.put(item, timeout=1.0)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run_account(self, account: Account, start_date: datetime.date, end_date: datetime.date):
+        """
+        Fetches the given account and passes the chunks on to the archiving thread.
+
+        :param account: account to fetch.
+        :param start_date: first day to fetch.
+        :param end_date: last day to fetch.
+        """
+        success = False
+        try:
+            for chunk_end, transactions in self._fetch_chunks(account, start_date, end_date):
+                if not self._put((account, chunk_end, transactions)):
+                    return
+            success = True
+        except Exception as e:
+            logging.exception("Not able to backfill account '%s' with IBAN '%s'.", account.name, account.iban)
+        finally:
+            self._put((account, None, success))
+
+    def run(self, accounts: List[Account], start_date: datetime.date, end_date: datetime.date) -> Tuple[int, int]:
+        """
+        Archives the transactions of the given accounts in the given date range. Accounts that were
+        already (partially) archived continue after the last archived day.
+
+        :param accounts: accounts to archive.
+        :param start_date: first day to archive.
+        :param end_date: last day to archive.
+        :return: tuple of the number of archived transactions and the number of failed accounts.
+        """
+        self._abort.clear()
+        num_archived = 0
+        num_failed = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            try:
+                num_pending = 0
+                for account in accounts:
+                    account_start = start_date
+                    progress = self.archive.get_progress(account.iban)
+                    if progress is not None:
+                        account_start = max(start_date, progress + datetime.timedelta(days=1))
+                    if account_start > end_date:
+                        logging.info("Account '%s' with IBAN '%s' is already archived up to %s.",
+                                     account.name, account.iban, progress)
+                        continue
+
+                    if account.url not in self._bank_semaphores.keys():
+                        self._bank_semaphores[account.url] = threading.BoundedSemaphore(self.max_concurrency_per_bank)
+                    executor.submit(self._run_account, account, account_start, end_date)
+                    num_pending += 1
+
+                while num_pending > 0:
+                    account, chunk_end, result = self._queue.get()
+
+                    # Account finished.
+                    if chunk_end is None:
+                        num_pending -= 1
+                        if not result:
+                            num_failed += 1
+                        continue
+
+                    self.archive.write(account.iban, chunk_end, result)
+                    num_archived += len(result)
+                    logging.info("Archived %d transaction(s) up to %s of account '%s' with IBAN '%s'.",
+                                 len(result), chunk_end, account.name, account.iban)
+
+            finally:
+                self._abort.set()
+
+        return num_archived, num_failed
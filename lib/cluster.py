@@ -0,0 +1,298 @@
+import bisect
+import hashlib
+import hmac
+import http.server
+import json
+import logging
+import threading
+import time
+import urllib.request
+from typing import Any, Callable, Dict, List, Optional
+
+
+class HashRing(object):
+    """
+    Consistent hash ring distributing keys (e.g., accounts) over nodes (e.g., workers). When a node
+    is added or removed, only the keys of this node move to other nodes.
+    """
+
+    def __init__(self, nodes: List[str], virtual_nodes: int = 64):
+        """
+
+        :param nodes: identifiers of the nodes.
+        :param virtual_nodes: number of points on the ring per node (more points spread the keys more evenly).
+        """
+        self.nodes = sorted(set(nodes))
+        self.virtual_nodes = virtual_nodes
+
+        points = list()
+        for node in self.nodes:
+            for i in range(virtual_nodes):
+                points.append((self._hash("%s#%d" % (node, i)), node))
+        points.sort()
+        self._hashes = list(map(lambda x: x[0], points))
+        self._nodes = list(map(lambda x: x[1], points))
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        """
+        Hashes the given key to a position on the ring (stable over processes and machines).
+
+        :param key: key to hash.
+        :return: position on the ring.
+        """
+        return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+    def get_node(self, key: str) -> Optional[str]:
+        """
+        Gets the node responsible for the given key.
+
+        :param key: key to look up.
+        :return: identifier of the node (None if the ring is empty).
+        """
+        if not self._hashes:
+            return None
+        pos = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._nodes[pos]
+
+
+class ClusterCoordinator(threading.Thread):
+    """
+    HTTP server tracking the workers of a sharded deployment. Workers send heartbeats with their health
+    and metrics and get the current list of live workers in return, from which they compute the accounts
+    they are responsible for. Workers that miss their heartbeats are removed and their accounts are taken
+    over by the remaining workers. The status of all workers is exposed as json under /workers.
+    Requests without the shared secret in the X-Cluster-Secret header are rejected.
+    """
+
+    def __init__(self, address: str, port: int, shared_secret: str, worker_timeout: int = 30):
+        """
+
+        :param address: address to listen on.
+        :param port: port to listen on.
+        :param shared_secret: secret the workers have to send with each request.
+        :param worker_timeout: seconds without heartbeat after which a worker is considered dead.
+        """
+        threading.Thread.__init__(self, name="ClusterCoordinator")
+        self.daemon = True
+        self.worker_timeout = worker_timeout
+        self._shared_secret = shared_secret.encode("utf-8")
+
+        self._lock = threading.Lock()
+        self._workers = dict()  # type: Dict[str, Dict[str, Any]]
+
+        # Increased each time the set of live workers changes.
+        self._generation = 0
+
+        coordinator = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def _send_json(self, data: Any):
+                body = json.dumps(data, sort_keys=True).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _authorized(self) -> bool:
+                # Constant time comparison, hence the secret can not be guessed from the response times.
+                secret = self.headers.get("X-Cluster-Secret", "").encode("utf-8")
+                if hmac.compare_digest(secret, coordinator._shared_secret):
+                    return True
+                logging.warning("Rejected request from '%s' without valid cluster secret.", self.client_address[0])
+                self.send_error(403)
+                return False
+
+            def do_GET(self):
+                if not self._authorized():
+                    return
+                if self.path != "/workers":
+                    self.send_error(404)
+                    return
+                self._send_json(coordinator.get_status())
+
+            def do_POST(self):
+                if not self._authorized():
+                    return
+                if self.path != "/heartbeat":
+                    self.send_error(404)
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length", "0"))
+                    data = json.loads(self.rfile.read(length).decode("utf-8"))
+                    worker_id = str(data["id"])
+                except Exception:
+                    self.send_error(400)
+                    return
+                self._send_json(coordinator.heartbeat(worker_id, data.get("status", dict()), self.client_address[0]))
+
+            def log_message(self, format, *args):
+                logging.debug("Cluster coordinator: " + format, *args)
+
+        self._server = http.server.ThreadingHTTPServer((address, port), Handler)
+
+    def _expire_workers(self):
+        """
+        Removes the workers that missed their heartbeats. Has to be called with the lock held.
+        """
+        now = time.monotonic()
+        for worker_id in list(self._workers.keys()):
+            if now - self._workers[worker_id]["last_seen"] > self.worker_timeout:
+                logging.warning("Worker '%s' missed its heartbeats. Reassigning its accounts.", worker_id)
+                del self._workers[worker_id]
+                self._generation += 1
+
+    def heartbeat(self, worker_id: str, status: Dict[str, Any], address: str) -> Dict[str, Any]:
+        """
+        Processes the heartbeat of a worker.
+
+        :param worker_id: identifier of the worker.
+        :param status: health and metrics reported by the worker.
+        :param address: address the heartbeat was sent from.
+        :return: dictionary with the generation and the sorted identifiers of the live workers.
+        """
+        with self._lock:
+            self._expire_workers()
+            if worker_id not in self._workers.keys():
+                logging.info("Worker '%s' at '%s' joined. Reassigning accounts.", worker_id, address)
+                self._generation += 1
+            self._workers[worker_id] = {"last_seen": time.monotonic(),
+                                        "address": address,
+                                        "status": status}
+            return {"generation": self._generation,
+                    "workers": sorted(self._workers.keys())}
+
+    def get_status(self) -> Dict[str, Any]:
+        """
+        Gets the status of the live workers.
+
+        :return: dictionary with the generation and the reported status of each live worker.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire_workers()
+            workers = dict()
+            for worker_id, worker in self._workers.items():
+                workers[worker_id] = {"address": worker["address"],
+                                      "last_heartbeat": now - worker["last_seen"],
+                                      "status": worker["status"]}
+            return {"generation": self._generation, "workers": workers}
+
+    def run(self):
+        """
+        Serves the workers until exit() is called.
+        """
+        self._server.serve_forever()
+
+    def exit(self):
+        """
+        Stops the server.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class ClusterWorker(threading.Thread):
+    """
+    Sends heartbeats of a worker to the coordinator and keeps the hash ring of the live workers that decides
+    which accounts this worker is responsible for. If the coordinator is not reachable, the last known ring
+    is kept (alerts are still not sent twice since they are claimed in the shared state database).
+    """
+
+    def __init__(self,
+                 worker_id: str,
+                 coordinator_url: str,
+                 shared_secret: str,
+                 heartbeat_interval: int = 10,
+                 virtual_nodes: int = 64,
+                 status_func: Optional[Callable[[], Dict[str, Any]]] = None,
+                 on_change: Optional[Callable[[], None]] = None):
+        """
+
+        :param worker_id: identifier of this worker (has to be unique in the cluster).
+        :param coordinator_url: URL of the coordinator (e.g., http://127.0.0.1:9481).
+        :param shared_secret: secret sent with each request to the coordinator.
+        :param heartbeat_interval: seconds between two heartbeats.
+        :param virtual_nodes: number of points on the hash ring per worker.
+        :param status_func: function returning the health and metrics reported with each heartbeat.
+        :param on_change: function called when the set of live workers changed.
+        """
+        threading.Thread.__init__(self, name="ClusterWorker")
+        self.daemon = True
+        self.worker_id = worker_id
+        self.coordinator_url = coordinator_url.rstrip("/")
+        self.shared_secret = shared_secret
+        self.heartbeat_interval = heartbeat_interval
+        self.virtual_nodes = virtual_nodes
+        self.status_func = status_func
+        self.on_change = on_change
+
+        self._lock = threading.Lock()
+        self._exit_flag = threading.Event()
+        self._ring = None  # type: Optional[HashRing]
+        self.generation = -1
+
+    def is_responsible(self, key: str) -> bool:
+        """
+        Checks if this worker is responsible for the given key.
+
+        :param key: key of the account.
+        :return: True if this worker is responsible (False as long as the workers are not known).
+        """
+        with self._lock:
+            return self._ring is not None and self._ring.get_node(key) == self.worker_id
+
+    def get_num_workers(self) -> int:
+        """
+        Gets the number of live workers.
+
+        :return: number of live workers (1 as long as the workers are not known).
+        """
+        with self._lock:
+            return len(self._ring.nodes) if self._ring is not None else 1
+
+    def _send_heartbeat(self):
+        """
+        Sends a heartbeat to the coordinator and updates the hash ring if the live workers changed.
+        """
+        data = {"id": self.worker_id,
+                "status": self.status_func() if self.status_func is not None else dict()}
+        request = urllib.request.Request(self.coordinator_url + "/heartbeat",
+                                         data=json.dumps(data).encode("utf-8"),
+                                         headers={"Content-Type": "application/json",
+                                                  "X-Cluster-Secret": self.shared_secret},
+                                         method="POST")
+        with urllib.request.urlopen(request, timeout=self.heartbeat_interval) as response:
+            result = json.loads(response.read().decode("utf-8"))
+
+        with self._lock:
+            workers = result["workers"]
+            if self._ring is not None and self._ring.nodes == sorted(set(workers)):
+                self.generation = result["generation"]
+                return
+            self._ring = HashRing(workers, self.virtual_nodes)
+            self.generation = result["generation"]
+
+        logging.info("Live workers changed to: %s", ", ".join(workers))
+        if self.on_change is not None:
+            self.on_change()
+
+    def run(self):
+        """
+        Sends heartbeats until exit() is called.
+        """
+        while not self._exit_flag.is_set():
+            try:
+                self._send_heartbeat()
+            except Exception as e:
+                logging.warning("Not able to send heartbeat to coordinator at '%s': %s",
+                                self.coordinator_url, e)
+            self._exit_flag.wait(self.heartbeat_interval)
+
+    def exit(self):
+        """
+        Stops sending heartbeats.
+        """
+        self._exit_flag.set()
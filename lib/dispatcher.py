@@ -0,0 +1,160 @@
+import logging
+import queue
+import threading
+import time
+from .metrics import metrics
+from .profiler import profiler
+from typing import Callable, List
+
+
+class TransientEventError(Exception):
+    """
+    Raised by a notification if sending it failed temporarily and it should be retried.
+    """
+    pass
+
+
+class EventDispatcher(object):
+    """
+    Sends the notifications of all events with a fixed number of worker threads from a bounded queue.
+    """
+
+    def __init__(self,
+                 num_workers: int = 2,
+                 queue_size: int = 1000,
+                 max_retries: int = 5,
+                 retry_delay: float = 2.0,
+                 max_retry_delay: float = 300.0):
+        """
+
+        :param num_workers: number of threads sending notifications.
+        :param queue_size: maximum number of notifications waiting to be sent.
+        :param max_retries: number of times a temporarily failed notification is retried.
+        :param retry_delay: seconds to wait before the first retry (doubled for each further retry).
+        :param max_retry_delay: maximum seconds to wait before a retry.
+        """
+        self.num_workers = num_workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._workers = list()  # type: List[threading.Thread]
+
+        # Flag to stop accepting new notifications.
+        self._accepting = True
+
+        # Set to abort waiting for retries on shutdown.
+        self._abort = threading.Event()
+
+    def start(self):
+        """
+        Starts the worker threads.
+        """
+        for i in range(self.num_workers):
+            worker = threading.Thread(target=self._run_worker, name="EventDispatcher-%d" % i)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, func: Callable[[], None], description: str) -> bool:
+        """
+        Queues a notification to be sent by the worker threads. Waits for a free place if the queue is full,
+        since the transaction of the notification is already stored as triggered and would never be notified
+        again. Hence, the checks are slowed down while the notifications can not be sent fast enough.
+
+        :param func: function sending the notification. Raises TransientEventError if it should be retried.
+        :param description: description of the notification used for logging.
+        :return: True if the notification was queued.
+        """
+        if not self._accepting:
+            logging.error("Dropping notification '%s' since the dispatcher is shutting down.", description)
+            metrics.add(None, "push_failures")
+            return False
+
+        try:
+            self._queue.put_nowait((func, description))
+        except queue.Full:
+            logging.warning("Dispatcher queue is full. Waiting to queue notification '%s'.", description)
+            self._queue.put((func, description))
+        return True
+
+    def shutdown(self, timeout: float):
+        """
+        Stops accepting notifications and waits until the queued ones are sent.
+
+        :param timeout: maximum seconds to wait for the queued notifications.
+        """
+        self._accepting = False
+
+        logging.info("Waiting for %d queued notification(s) to be sent.", self._queue.unfinished_tasks)
+
+        end_time = time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = end_time - time.monotonic()
+                if remaining <= 0:
+                    logging.error("Not able to send %d queued notification(s) before shutdown.",
+                                  self._queue.unfinished_tasks)
+                    break
+                self._queue.all_tasks_done.wait(remaining)
+
+        # Stop the worker threads (also those waiting for a retry).
+        self._abort.set()
+        for _ in self._workers:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+
+    def _run_worker(self):
+        """
+        Sends the queued notifications and retries temporarily failed ones with exponential backoff.
+        """
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+
+            func, description = item
+            try:
+                self._send(func, description)
+            finally:
+                self._queue.task_done()
+
+    def _send(self, func: Callable[[], None], description: str):
+        """
+        Sends a single notification.
+
+        :param func: function sending the notification.
+        :param description: description of the notification used for logging.
+        """
+        retries = 0
+        while True:
+            try:
+                with metrics.phase(None, "push"):
+                    profiler.run(func)
+                return
+
+            except TransientEventError as e:
+                if retries >= self.max_retries:
+                    logging.error("Giving up sending notification '%s' after %d retries: %s",
+                                  description, retries, e)
+                    metrics.add(None, "push_failures")
+                    return
+
+                delay = min(self.retry_delay * (2 ** retries), self.max_retry_delay)
+                retries += 1
+                logging.warning("Sending notification '%s' failed temporarily: %s Retrying in %.1f seconds.",
+                                description, e, delay)
+
+                if self._abort.wait(delay):
+                    logging.error("Dropping notification '%s' on shutdown.", description)
+                    metrics.add(None, "push_failures")
+                    return
+
+            except Exception as e:
+                logging.exception("Sending notification '%s' failed.", description)
+                metrics.add(None, "push_failures")
+                return
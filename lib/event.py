@@ -1,8 +1,12 @@
 from .transaction import SimpleTransaction
+from .dispatcher import EventDispatcher, TransientEventError
+from .metrics import metrics
+from typing import Dict, List, Tuple
+import decimal
+import importlib.util
 import logging
-from lightweightpush import LightweightPush
-from lightweightpush import ErrorCodes as LPErrorCodes
 import threading
+import time
 
 
 class Event(object):
@@ -10,8 +14,14 @@ class Event(object):
     Abstract object for events that can be triggered by an unknown transaction.
     """
 
-    def __init__(self, id: int):
+    def __init__(self, id: int, dispatcher: EventDispatcher):
+        """
+
+        :param id: id of the event.
+        :param dispatcher: dispatcher that sends the notifications of the event.
+        """
         self.id = id
+        self.dispatcher = dispatcher
 
     def trigger(self, account, transaction: SimpleTransaction):
         """
@@ -22,25 +32,78 @@ class Event(object):
         """
         raise NotImplementedError("Not yet implemented.")
 
+    def flush(self, force: bool = False):
+        """
+        Sends the notifications the event collected. Called after each processing round.
+
+        :param force: send the collected notifications even if the digest time window has not passed yet.
+        """
+        pass
+
 
 class EventLightweightPush(Event):
     """
     Event that triggers a push notification via the AlertR Push Notification service.
     """
 
-    def __init__(self, id: int, username: str, password: str, shared_secret: str, channel: str):
+    DIGEST_NONE = "none"
+    DIGEST_ACCOUNT = "account"
+    DIGEST_ALL = "all"
+
+    # Minimum allowed maximum message size and minimum number of characters kept of each digest line.
+    MIN_MSG_SIZE = 200
+    MIN_LINE_SIZE = 100
+
+    def __init__(self,
+                 id: int,
+                 dispatcher: EventDispatcher,
+                 username: str,
+                 password: str,
+                 shared_secret: str,
+                 channel: str,
+                 digest: str = "none",
+                 digest_window: int = 0,
+                 max_msg_size: int = 2500):
         """
 
         :param id: id of the event.
+        :param dispatcher: dispatcher that sends the notifications of the event.
         :param username: username for the lightweight push service.
         :param password: password for the lightweight push service.
         :param shared_secret: shared secret used to encrypt the message.
         :param channel: channel the message is sent to.
+        :param digest: "none" to send one message per transaction, "account" to send one message
+                       per account and "all" to send one message for all accounts.
+        :param digest_window: minimum seconds the transactions are collected for a digest message
+                              (0 to send the digest message after each processing round).
+        :param max_msg_size: maximum number of characters of a digest message before it is split.
         """
-        super().__init__(id)
+        super().__init__(id, dispatcher)
 
-        self.push_service = LightweightPush(username, password, shared_secret)
+        if digest not in (self.DIGEST_NONE, self.DIGEST_ACCOUNT, self.DIGEST_ALL):
+            raise ValueError("Unknown digest mode '%s'." % digest)
+
+        # The package is only imported when the first message is sent. A missing package has to be noticed
+        # right away since the transaction of the first message is already stored as triggered by then.
+        if importlib.util.find_spec("lightweightpush") is None:
+            raise ImportError("Package 'lightweightpush' needed by event '%d' is not installed." % id)
+
+        self.username = username
+        self.password = password
+        self.shared_secret = shared_secret
         self.channel = channel
+        self.digest = digest
+        self.digest_window = digest_window
+        self.max_msg_size = max_msg_size
+
+        # Client of the push service (created when the first message is sent).
+        self._push_service = None
+        self._push_service_lock = threading.Lock()
+
+        # Transactions collected for the next digest message.
+        self._pending = list()  # type: List[Tuple[object, SimpleTransaction]]
+        self._pending_since = 0.0
+        self._pending_lock = threading.Lock()
 
     def _pretty_iban(self, iban: str) -> str:
         """
@@ -57,6 +120,19 @@ class EventLightweightPush(Event):
             new_iban += iban[i]
         return new_iban
 
+    def _get_push_service(self):
+        """
+        Gets the client of the push service. The lightweightpush package is only imported when
+        the first message is sent.
+
+        :return: lightweight push client.
+        """
+        with self._push_service_lock:
+            if self._push_service is None:
+                from lightweightpush import LightweightPush
+                self._push_service = LightweightPush(self.username, self.password, self.shared_secret)
+            return self._push_service
+
     def _send(self, subject, msg):
         """
         Internal function that sends message to lightweight push server.
@@ -64,12 +140,14 @@ class EventLightweightPush(Event):
         :param subject: subject of the notification.
         :param msg: message body of the notification.
         """
-        error_code = self.push_service.send_msg(subject, msg, self.channel)
+        from lightweightpush import ErrorCodes as LPErrorCodes
+
+        error_code = self._get_push_service().send_msg(subject, msg, self.channel)
 
         if error_code == LPErrorCodes.NO_ERROR:
-            pass
+            return
         elif error_code == LPErrorCodes.DATABASE_ERROR:
-            logging.error("Database error on lightweight push server. Please contact administrator.")
+            raise TransientEventError("Database error on lightweight push server.")
         elif error_code == LPErrorCodes.AUTH_ERROR:
             logging.error("Lightweight push authentication failed. Are the user credentials wrong?")
         elif error_code == LPErrorCodes.ILLEGAL_MSG_ERROR:
@@ -79,9 +157,90 @@ class EventLightweightPush(Event):
             logging.error("Version from lightweight push package and server do not match. "
                           + "Please upgrade lightweight push package.")
         elif error_code == LPErrorCodes.CLIENT_CONNECTION_ERROR:
-            logging.error("Lightweight push Client could not connect to the server.")
+            raise TransientEventError("Lightweight push Client could not connect to the server.")
         else:
-            logging.error("Sending lightweight push message failed with error code: %d" % error_code)
+            logging.error("Sending lightweight push message failed with error code: %d", error_code)
+
+        metrics.add(None, "push_failures")
+
+    def _create_digest(self, transactions: List[Tuple[object, SimpleTransaction]]) -> List[Tuple[str, str]]:
+        """
+        Creates the messages summarizing the given transactions. The transactions are split into
+        multiple messages if they do not fit into the maximum message size.
+
+        :param transactions: list of tuples of account and transaction.
+        :return: list of tuples of subject and message body.
+        """
+
+        sums = dict()  # type: Dict[str, decimal.Decimal]
+        account_names = list()
+        for account, transaction in transactions:
+            sums[transaction.currency] = sums.get(transaction.currency, 0) + transaction.amount
+            if account.name not in account_names:
+                account_names.append(account.name)
+
+        sums_str = ", ".join(map(lambda x: "%+.2f %s" % (sums[x], x), sorted(sums.keys())))
+        num_str = "%d transaction%s" % (len(transactions), "" if len(transactions) == 1 else "s")
+        subject = "%s: %s" % (num_str, sums_str)
+
+        if len(account_names) == 1:
+            account = transactions[0][0]
+            header = "%s on account %s (%s).\n" % (num_str, account.name, self._pretty_iban(account.iban))
+        else:
+            header = "%d transactions on accounts %s.\n" % (len(transactions), ", ".join(account_names))
+        header += "Sum: %s\n\n" % sums_str
+
+        # Name only the number of accounts if their names do not leave enough space for the transactions.
+        if len(account_names) > 1 and len(header) + self.MIN_LINE_SIZE > self.max_msg_size:
+            header = "%d transactions on %d accounts.\nSum: %s\n\n" % (len(transactions),
+                                                                       len(account_names),
+                                                                       sums_str)
+
+        # Split the list of transactions into parts that fit into the message size.
+        parts = list()
+        part = ""
+        for account, transaction in transactions:
+            if len(account_names) == 1:
+                line = "- %s\n" % str(transaction)
+            else:
+                line = "- %s: %s\n" % (account.name, str(transaction))
+            # Lines are never cut below the minimum size, even if the message exceeds its maximum size then.
+            line = line[:max(self.max_msg_size - len(header), self.MIN_LINE_SIZE)]
+            if part and len(header) + len(part) + len(line) > self.max_msg_size:
+                parts.append(part)
+                part = ""
+            part += line
+        parts.append(part)
+
+        if len(parts) == 1:
+            return [(subject, header + parts[0])]
+        return list(map(lambda x: ("%s (%d/%d)" % (subject, x[0] + 1, len(parts)), header + x[1]),
+                        enumerate(parts)))
+
+    def flush(self, force: bool = False):
+        """
+        Sends the collected transactions as digest messages.
+
+        :param force: send the collected transactions even if the digest time window has not passed yet.
+        """
+
+        with self._pending_lock:
+            if not self._pending:
+                return
+            if not force and (time.monotonic() - self._pending_since) < self.digest_window:
+                return
+            pending = self._pending
+            self._pending = list()
+
+        # Group transactions per account if a digest message per account is wanted.
+        groups = dict()
+        for account, transaction in pending:
+            key = account if self.digest == self.DIGEST_ACCOUNT else None
+            groups.setdefault(key, list()).append((account, transaction))
+
+        for group in groups.values():
+            for subject, msg in self._create_digest(group):
+                self.dispatcher.submit(lambda subject=subject, msg=msg: self._send(subject, msg), subject)
 
     def trigger(self, account, transaction: SimpleTransaction):
         """
@@ -91,6 +250,14 @@ class EventLightweightPush(Event):
         :param transaction: transaction object that triggered the event.
         """
 
+        # Collect transaction for the next digest message.
+        if self.digest != self.DIGEST_NONE:
+            with self._pending_lock:
+                if not self._pending:
+                    self._pending_since = time.monotonic()
+                self._pending.append((account, transaction))
+            return
+
         amount = transaction.amount
         if amount < 0:
             subject = "Transaction: %.2f %s withdrawn." % ((amount * (-1)), transaction.currency)
@@ -105,6 +272,5 @@ class EventLightweightPush(Event):
         date_str = transaction.date.strftime("%Y-%m-%d")
         msg += "Date: %s\n" % date_str
 
-        # Send message via thread to be non-blocking.
-        thread = threading.Thread(target=self._send, args=(subject, msg))
-        thread.start()
+        # Send message via dispatcher to be non-blocking.
+        self.dispatcher.submit(lambda: self._send(subject, msg), subject)
@@ -0,0 +1,145 @@
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import time
+from typing import Optional
+
+
+class RotatingLogFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    Log file handler rotating the file when it reaches a maximum size or after a fixed interval,
+    whichever comes first. Rotated files are numbered like the ones of the RotatingFileHandler.
+    """
+
+    def __init__(self, filename: str, max_bytes: int = 0, backup_count: int = 5, rotate_interval: int = 0):
+        """
+
+        :param filename: location of the log file.
+        :param max_bytes: size in bytes after which the file is rotated (0 for no size limit).
+        :param backup_count: number of rotated files kept.
+        :param rotate_interval: seconds after which the file is rotated (0 for no time limit).
+        """
+        logging.handlers.RotatingFileHandler.__init__(self,
+                                                      filename,
+                                                      maxBytes=max_bytes,
+                                                      backupCount=backup_count,
+                                                      encoding="utf-8")
+        self.rotate_interval = rotate_interval
+
+        # Like the TimedRotatingFileHandler, an existing file counts from its last modification.
+        start = time.time()
+        if os.path.exists(self.baseFilename):
+            start = os.stat(self.baseFilename).st_mtime
+        self._rotate_at = start + rotate_interval
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.rotate_interval > 0 and time.time() >= self._rotate_at:
+            return True
+        return logging.handlers.RotatingFileHandler.shouldRollover(self, record)
+
+    def doRollover(self):
+        logging.handlers.RotatingFileHandler.doRollover(self)
+        self._rotate_at = time.time() + self.rotate_interval
+
+
+class JsonLogFormatter(logging.Formatter):
+    """
+    Formats each log record as one json object per line.
+    """
+
+    def __init__(self, worker: Optional[str] = None):
+        """
+
+        :param worker: identifier of the worker added to each record (None for no worker).
+        """
+        logging.Formatter.__init__(self)
+        self.worker = worker
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {"time": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+                "level": record.levelname,
+                "thread": record.threadName,
+                "message": record.getMessage()}
+        if self.worker is not None:
+            data["worker"] = self.worker
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands the log records over to the writer thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only the message is merged here since the arguments may change before the writer formats them.
+        # Level and time formatting are left to the formatter of the writer thread.
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(log_file: str,
+                  log_level: int,
+                  log_format: str = "text",
+                  max_bytes: int = 0,
+                  backup_count: int = 5,
+                  rotate_interval: int = 0,
+                  worker: Optional[str] = None) -> logging.handlers.QueueListener:
+    """
+    Sets up the logging of the daemon. Log records are put into a queue and written to the log file by a
+    background thread so that a slow disk does not delay the checks. The thread is stopped (after writing
+    the remaining records) on exit.
+
+    :param log_file: location of the log file.
+    :param log_level: minimum level of the logged records.
+    :param log_format: format of the log file (text or json).
+    :param max_bytes: size in bytes after which the log file is rotated (0 for no size limit).
+    :param backup_count: number of rotated log files kept.
+    :param rotate_interval: seconds after which the log file is rotated (0 for no time limit).
+    :param worker: identifier of the worker added to each record (None for no worker).
+    :return: listener writing the log records.
+    """
+    if log_format == "text":
+        prefix = "%(asctime)s "
+        if worker is not None:
+            prefix += worker.replace("%", "%%") + " "
+        formatter = logging.Formatter(prefix + "%(levelname)s: %(message)s", datefmt="%m/%d/%Y %H:%M:%S")
+    elif log_format == "json":
+        formatter = JsonLogFormatter(worker)
+    else:
+        raise ValueError("Unknown log format '%s'." % log_format)
+
+    if max_bytes < 0:
+        raise ValueError("Maximum log file size has to be at least 0.")
+    if rotate_interval < 0:
+        raise ValueError("Log rotation interval has to be at least 0.")
+    if (max_bytes > 0 or rotate_interval > 0) and backup_count <= 0:
+        raise ValueError("Number of rotated log files has to be larger than 0.")
+
+    file_handler = RotatingLogFileHandler(log_file, max_bytes, backup_count, rotate_interval)
+    file_handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, file_handler)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_QueueHandler(log_queue))
+    root.setLevel(log_level)
+
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,228 @@
+import http.server
+import json
+import logging
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+
+class _NullTimer(object):
+    """
+    Timer used when metrics are disabled. Does nothing.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+class _PhaseTimer(object):
+    """
+    Measures the duration of a processing phase.
+    """
+
+    def __init__(self, metrics: "Metrics", iban: Optional[str], phase: str):
+        self._metrics = metrics
+        self._iban = iban
+        self._phase = phase
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._metrics.observe(self._iban, self._phase, time.perf_counter() - self._start)
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics(object):
+    """
+    Collects the durations of the processing phases and counters per account. When disabled,
+    recording a value only costs a single attribute check.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+
+        # Durations (count, sum, last, max) and counters by account IBAN (None for global values) and name.
+        self._durations = dict()  # type: Dict[Tuple[Optional[str], str], list]
+        self._counters = dict()  # type: Dict[Tuple[Optional[str], str], int]
+
+    def phase(self, iban: Optional[str], phase: str):
+        """
+        Gets a context manager measuring the duration of a processing phase.
+
+        :param iban: IBAN of the account the phase belongs to (None for global phases).
+        :param phase: name of the phase.
+        :return: context manager.
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _PhaseTimer(self, iban, phase)
+
+    def observe(self, iban: Optional[str], phase: str, duration: float):
+        """
+        Records the duration of a processing phase.
+
+        :param iban: IBAN of the account the phase belongs to (None for global phases).
+        :param phase: name of the phase.
+        :param duration: duration in seconds.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            values = self._durations.get((iban, phase))
+            if values is None:
+                self._durations[(iban, phase)] = [1, duration, duration, duration]
+            else:
+                values[0] += 1
+                values[1] += duration
+                values[2] = duration
+                values[3] = max(values[3], duration)
+
+    def add(self, iban: Optional[str], counter: str, value: int = 1):
+        """
+        Increases a counter.
+
+        :param iban: IBAN of the account the counter belongs to (None for global counters).
+        :param counter: name of the counter.
+        :param value: value to add.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[(iban, counter)] = self._counters.get((iban, counter), 0) + value
+
+    @staticmethod
+    def _labels(iban: Optional[str], **kwargs) -> str:
+        labels = list()
+        if iban is not None:
+            labels.append("iban=\"%s\"" % iban)
+        for key, value in sorted(kwargs.items()):
+            labels.append("%s=\"%s\"" % (key, value))
+        return "{%s}" % ",".join(labels) if labels else ""
+
+    def get_prometheus(self) -> str:
+        """
+        Gets the metrics in the Prometheus text format.
+
+        :return: metrics string.
+        """
+        with self._lock:
+            durations = sorted(self._durations.items(), key=lambda x: (x[0][0] or "", x[0][1]))
+            counters = sorted(self._counters.items(), key=lambda x: (x[0][0] or "", x[0][1]))
+
+        lines = list()
+        lines.append("# TYPE banking_monitor_phase_seconds summary")
+        for (iban, phase), values in durations:
+            labels = self._labels(iban, phase=phase)
+            lines.append("banking_monitor_phase_seconds_count%s %d" % (labels, values[0]))
+            lines.append("banking_monitor_phase_seconds_sum%s %f" % (labels, values[1]))
+        lines.append("# TYPE banking_monitor_phase_last_seconds gauge")
+        for (iban, phase), values in durations:
+            lines.append("banking_monitor_phase_last_seconds%s %f" % (self._labels(iban, phase=phase), values[2]))
+        lines.append("# TYPE banking_monitor_phase_max_seconds gauge")
+        for (iban, phase), values in durations:
+            lines.append("banking_monitor_phase_max_seconds%s %f" % (self._labels(iban, phase=phase), values[3]))
+
+        names = sorted(set(map(lambda x: x[0][1], counters)))
+        for name in names:
+            lines.append("# TYPE banking_monitor_%s_total counter" % name)
+            for (iban, counter), value in counters:
+                if counter == name:
+                    lines.append("banking_monitor_%s_total%s %d" % (name, self._labels(iban), value))
+
+        return "\n".join(lines) + "\n"
+
+    def get_dict(self) -> Dict[str, Dict[str, dict]]:
+        """
+        Gets the metrics as dictionary by account IBAN ("global" for global values).
+
+        :return: metrics dictionary.
+        """
+        result = dict()
+        with self._lock:
+            for (iban, phase), values in self._durations.items():
+                account = result.setdefault(iban or "global", {"phases": dict(), "counters": dict()})
+                account["phases"][phase] = {"count": values[0],
+                                            "sum": values[1],
+                                            "last": values[2],
+                                            "max": values[3]}
+            for (iban, counter), value in self._counters.items():
+                account = result.setdefault(iban or "global", {"phases": dict(), "counters": dict()})
+                account["counters"][counter] = value
+        return result
+
+    def dump_json(self, file_location: str):
+        """
+        Writes the metrics as json file.
+
+        :param file_location: file location of the json file.
+        """
+        data = {"time": int(time.time()), "accounts": self.get_dict()}
+        with open(file_location, 'w') as fp:
+            json.dump(data, fp, indent=4, sort_keys=True)
+
+
+class MetricsServer(threading.Thread):
+    """
+    Local HTTP server that exposes the metrics in the Prometheus text format under /metrics
+    and as json under /metrics.json.
+    """
+
+    def __init__(self, metrics: Metrics, address: str, port: int):
+        """
+
+        :param metrics: metrics to expose.
+        :param address: address to listen on.
+        :param port: port to listen on.
+        """
+        threading.Thread.__init__(self, name="MetricsServer")
+        self.daemon = True
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = metrics.get_prometheus().encode("utf-8")
+                    content_type = "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body = json.dumps(metrics.get_dict(), sort_keys=True).encode("utf-8")
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug("Metrics server: " + format, *args)
+
+        self._server = http.server.ThreadingHTTPServer((address, port), Handler)
+
+    def run(self):
+        """
+        Serves the metrics until exit() is called.
+        """
+        self._server.serve_forever()
+
+    def exit(self):
+        """
+        Stops the server.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+
+# Metrics of the daemon shared by all components (disabled until configured).
+metrics = Metrics()
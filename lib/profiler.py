@@ -0,0 +1,218 @@
+import cProfile
+import collections
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+from typing import Any, Callable, List, Optional
+
+
+# Since Python 3.12 cProfile uses sys.monitoring, hence one profile covers all threads of the process
+# and no second profile can be enabled while it is active.
+_PROCESS_WIDE_PROFILE = sys.version_info >= (3, 12)
+
+
+class _Sampler(threading.Thread):
+    """
+    Samples the stacks of all threads in a fixed interval.
+    """
+
+    def __init__(self, interval: float):
+        """
+
+        :param interval: seconds between two samples.
+        """
+        threading.Thread.__init__(self, name="ProfileSampler")
+        self.daemon = True
+        self.interval = interval
+
+        # Number of samples by collapsed stack (thread name and functions from the outermost to the innermost).
+        self.samples = collections.Counter()
+
+        self._exit_flag = threading.Event()
+
+    def run(self):
+        own_ident = threading.get_ident()
+        while not self._exit_flag.wait(self.interval):
+            thread_names = dict(map(lambda x: (x.ident, x.name), threading.enumerate()))
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = list()
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                    frame = frame.f_back
+                stack.append(thread_names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def exit(self):
+        """
+        Stops sampling.
+        """
+        self._exit_flag.set()
+
+
+class Profiler(object):
+    """
+    Profiles the next processing rounds on demand, either deterministically with cProfile or by sampling
+    the stacks of all threads. The deterministic profiler covers the main thread and all functions run
+    through run() (checks, rules reloads and notifications), or all threads at once on Python 3.12 and
+    later. When not started, run() only costs a single attribute check.
+    """
+
+    def __init__(self):
+        # Location prefix of the written files (e.g., the log file without extension).
+        self.output_prefix = "profile"
+        self.rounds = 1
+        self.sample_interval = 0.01
+
+        # Active profiling mode (None, deterministic or sampling).
+        self.mode = None  # type: Optional[str]
+
+        self._lock = threading.Lock()
+        self._rounds_left = 0
+        self._main_profile = None  # type: Optional[cProfile.Profile]
+        self._profiles = list()  # type: List[cProfile.Profile]
+        self._sampler = None  # type: Optional[_Sampler]
+
+    def _get_file_location(self, kind: str, extension: str) -> str:
+        return "%s.%s-%s.%s" % (self.output_prefix, kind, time.strftime("%Y%m%d-%H%M%S"), extension)
+
+    def start(self, mode: str):
+        """
+        Starts profiling the next rounds. Has to be called from the main thread.
+
+        :param mode: deterministic or sampling.
+        """
+        if mode not in ("deterministic", "sampling"):
+            raise ValueError("Unknown profiling mode '%s'." % mode)
+        if self.mode is not None:
+            logging.warning("Profiling (%s) is already running.", self.mode)
+            return
+
+        logging.info("Starting %s profiling of the next %d round(s).", mode, self.rounds)
+        with self._lock:
+            self._rounds_left = self.rounds
+            self._profiles = list()
+        if mode == "deterministic":
+            self._main_profile = cProfile.Profile()
+            try:
+                self._main_profile.enable()
+            except ValueError as e:
+                logging.error("Not able to start deterministic profiling: %s", e)
+                self._main_profile = None
+                return
+        else:
+            self._sampler = _Sampler(self.sample_interval)
+            self._sampler.start()
+        self.mode = mode
+
+    def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Runs the given function and profiles it if deterministic profiling is running.
+
+        :param func: function to run.
+        :return: return value of the function.
+        """
+        if self.mode != "deterministic" or _PROCESS_WIDE_PROFILE or sys.getprofile() is not None:
+            return func(*args, **kwargs)
+
+        profile = cProfile.Profile()
+        profiles = self._profiles
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already active, the function is not profiled then.
+            return func(*args, **kwargs)
+
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            with self._lock:
+                # Functions still running when the profiling finished are not part of the results.
+                if profiles is self._profiles:
+                    profiles.append(profile)
+
+    def finish_round(self):
+        """
+        Marks the end of a processing round and writes the results after the last profiled round.
+        Has to be called from the main thread.
+        """
+        if self.mode is None:
+            return
+        self._rounds_left -= 1
+        if self._rounds_left <= 0:
+            self.stop()
+
+    def stop(self):
+        """
+        Stops profiling and writes the results. Has to be called from the main thread.
+        """
+        mode = self.mode
+        if mode is None:
+            return
+        self.mode = None
+
+        try:
+            if mode == "deterministic":
+                self._main_profile.disable()
+                with self._lock:
+                    profiles = self._profiles
+                    self._profiles = list()
+                stats = None
+                for profile in [self._main_profile] + profiles:
+                    try:
+                        if stats is None:
+                            stats = pstats.Stats(profile)
+                        else:
+                            stats.add(profile)
+                    except TypeError:
+                        # Profiles without any recorded call can not be converted.
+                        continue
+                self._main_profile = None
+                if stats is None:
+                    raise ValueError("No calls were recorded.")
+
+                file_location = self._get_file_location("profile", "prof")
+                stats.dump_stats(file_location)
+
+            else:
+                self._sampler.exit()
+                self._sampler.join()
+                samples = self._sampler.samples
+                self._sampler = None
+
+                # One collapsed stack per line as used by flame graph tools.
+                file_location = self._get_file_location("samples", "txt")
+                with open(file_location, "w") as fp:
+                    for stack, count in samples.most_common():
+                        fp.write("%s %d\n" % (stack, count))
+
+            logging.info("Wrote %s profile to '%s'.", mode, file_location)
+
+        except Exception as e:
+            logging.exception("Not able to write %s profile.", mode)
+
+    def write_thread_stacks(self) -> str:
+        """
+        Writes the current stacks of all threads.
+
+        :return: location of the written file.
+        """
+        thread_names = dict(map(lambda x: (x.ident, x.name), threading.enumerate()))
+        file_location = self._get_file_location("stacks", "txt")
+        with open(file_location, "w") as fp:
+            for ident, frame in sys._current_frames().items():
+                fp.write("Thread '%s' (%d):\n" % (thread_names.get(ident, "unknown"), ident))
+                fp.write("".join(traceback.format_stack(frame)))
+                fp.write("\n")
+        return file_location
+
+
+# Profiler of the daemon shared by all components (started by signals).
+profiler = Profiler()
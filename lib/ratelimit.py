@@ -0,0 +1,157 @@
+import datetime
+import threading
+import time
+
+
+class RateLimitExceeded(Exception):
+    """
+    Raised if a request to a bank is not allowed by its rate limit or daily budget.
+    """
+
+    def __init__(self, msg: str, retry_after: float):
+        """
+
+        :param msg: error message.
+        :param retry_after: seconds after which the request can be made.
+        """
+        Exception.__init__(self, msg)
+        self.retry_after = retry_after
+
+
+class RateLimiter(object):
+    """
+    Token bucket limiting the requests to one bank endpoint. It is shared by all accounts using the endpoint.
+    Requests are allowed in bursts up to the bucket size and at the sustained rate afterwards. Additionally,
+    the number of requests per day can be limited. If the requests are made by multiple workers (each with its
+    own limiter), the limits are split evenly over the workers.
+    """
+
+    def __init__(self,
+                 url: str,
+                 requests_per_minute: float = 0.0,
+                 burst: int = 1,
+                 daily_budget: int = 0,
+                 max_wait: float = 30.0):
+        """
+
+        :param url: url of the bank endpoint (used for messages).
+        :param requests_per_minute: sustained number of requests per minute (0 for no limit).
+        :param burst: maximum number of requests made at once.
+        :param daily_budget: maximum number of requests per day (0 for no limit).
+        :param max_wait: maximum seconds a request waits for the rate limit before it is rejected.
+        """
+        self.url = url
+        self.rate = 0.0
+        self.burst = burst
+        self.daily_budget = daily_budget
+        self.max_wait = max_wait
+
+        self._lock = threading.Lock()
+
+        # Limits of this worker (the configured limits divided by the number of workers).
+        self._num_workers = 1
+        self._rate = 0.0
+        self._burst = burst
+        self._daily_budget = daily_budget
+
+        # A new limiter starts with a full bucket.
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._day = datetime.date.today()
+        self._used_today = 0
+        self.configure(requests_per_minute, burst, daily_budget, max_wait)
+
+    def configure(self, requests_per_minute: float, burst: int, daily_budget: int, max_wait: float):
+        """
+        Changes the limits (e.g., on a reload of the configuration) without resetting the used requests.
+
+        :param requests_per_minute: sustained number of requests per minute (0 for no limit).
+        :param burst: maximum number of requests made at once.
+        :param daily_budget: maximum number of requests per day (0 for no limit).
+        :param max_wait: maximum seconds a request waits for the rate limit before it is rejected.
+        """
+        if requests_per_minute < 0:
+            raise ValueError("Requests per minute for '%s' have to be at least 0." % self.url)
+        if burst <= 0:
+            raise ValueError("Burst for '%s' has to be larger than 0." % self.url)
+        if daily_budget < 0:
+            raise ValueError("Daily budget for '%s' has to be at least 0." % self.url)
+        if max_wait < 0:
+            raise ValueError("Maximum wait for '%s' has to be at least 0." % self.url)
+
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = requests_per_minute / 60.0
+            self.burst = burst
+            self.daily_budget = daily_budget
+            self.max_wait = max_wait
+            self._split_limits()
+
+    def set_num_workers(self, num_workers: int):
+        """
+        Splits the configured limits over the given number of workers that make requests to the bank endpoint.
+
+        :param num_workers: number of workers (each with its own limiter for the endpoint).
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self._num_workers = max(1, num_workers)
+            self._split_limits()
+
+    def _split_limits(self):
+        """
+        Computes the limits of this worker from the configured limits. Has to be called with the lock held.
+        """
+        # Burst and budget are rounded down to not exceed the configured limits in sum, but at least one
+        # request has to be possible (a budget of 0 would mean no limit).
+        self._rate = self.rate / self._num_workers
+        self._burst = max(1, self.burst // self._num_workers)
+        self._daily_budget = self.daily_budget
+        if self.daily_budget > 0:
+            self._daily_budget = max(1, self.daily_budget // self._num_workers)
+        self._tokens = min(self._tokens, float(self._burst))
+
+    def _refill(self, now: float):
+        """
+        Adds the tokens accumulated since the last refill. Has to be called with the lock held.
+
+        :param now: current monotonic time.
+        """
+        if self._rate > 0:
+            self._tokens = min(float(self._burst), self._tokens + (now - self._last_refill) * self._rate)
+        self._last_refill = now
+
+    def acquire(self):
+        """
+        Takes the permission for one request. Waits up to the maximum wait time for the rate limit.
+
+        :raises RateLimitExceeded: if the request is not allowed within the maximum wait time.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+
+            today = datetime.date.today()
+            if today != self._day:
+                self._day = today
+                self._used_today = 0
+
+            if self._daily_budget > 0 and self._used_today >= self._daily_budget:
+                tomorrow = datetime.datetime.combine(today + datetime.timedelta(days=1), datetime.time())
+                raise RateLimitExceeded("Daily budget of %d request(s) for '%s' is used up."
+                                        % (self._daily_budget, self.url),
+                                        (tomorrow - datetime.datetime.now()).total_seconds())
+
+            wait_time = 0.0
+            if self._rate > 0:
+                if self._tokens < 1.0:
+                    wait_time = (1.0 - self._tokens) / self._rate
+                    if wait_time > self.max_wait:
+                        raise RateLimitExceeded("Rate limit for '%s' reached." % self.url, wait_time)
+
+                # Reserve the token (the bucket can get negative for requests waiting for it).
+                self._tokens -= 1.0
+            self._used_today += 1
+
+        if wait_time > 0:
+            time.sleep(wait_time)
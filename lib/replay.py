@@ -0,0 +1,90 @@
+import csv
+import itertools
+import json
+import os
+from .archive import create_transaction, open_archive
+from .rules import Rules
+from .transaction import SimpleTransaction
+from typing import Callable, Iterator, TextIO, Tuple
+
+
+def read_transactions(file_location: str,
+                      on_error: Callable[[int, str], None]) -> Iterator[Tuple[int, SimpleTransaction]]:
+    """
+    Reads recorded transactions one by one from a csv file with header, a jsonl file
+    (one json object per line) with the transaction fields or a sqlite transaction archive.
+
+    :param file_location: file location of the recorded transactions (jsonl if it ends with .jsonl or .json,
+                          sqlite archive if it ends with .db, .sqlite or .sqlite3).
+    :param on_error: function called with the line number and the error message of an invalid record.
+    :return: iterator of tuples of line number and transaction object.
+    """
+    if file_location.lower().endswith((".db", ".sqlite", ".sqlite3")):
+
+        # Opening a missing sqlite archive would create an empty one.
+        if not os.path.isfile(file_location):
+            raise FileNotFoundError("Transaction archive '%s' does not exist." % file_location)
+        archive = open_archive(file_location)
+        try:
+            for num, obj in enumerate(archive.read(), 1):
+                yield num, obj
+        finally:
+            archive.close()
+        return
+
+    is_json = file_location.lower().endswith((".jsonl", ".json"))
+    with open(file_location, 'r', newline="") as fp:
+        if is_json:
+            for line_num, line in enumerate(fp, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_num, create_transaction(json.loads(line))
+                except ValueError as e:
+                    on_error(line_num, str(e))
+
+        else:
+            csv_reader = csv.DictReader(fp)
+            for record in csv_reader:
+                try:
+                    yield csv_reader.line_num, create_transaction(record)
+                except ValueError as e:
+                    on_error(csv_reader.line_num, str(e))
+
+
+def replay(rules: Rules,
+           transactions: Iterator[Tuple[int, SimpleTransaction]],
+           output: TextIO,
+           show_allowed: bool = False,
+           batch_size: int = 10000) -> Tuple[int, int]:
+    """
+    Checks the given transactions against the rules and writes the ones that would trigger
+    an event (and optionally the whitelisted ones with their matching rule) to the output.
+
+    :param rules: rules to check the transactions against.
+    :param transactions: iterator of tuples of line number and transaction object.
+    :param output: stream the results are written to.
+    :param show_allowed: also write the whitelisted transactions.
+    :param batch_size: number of transactions checked against the rules at once.
+    :return: tuple of the number of transactions that would trigger an event and of whitelisted ones.
+    """
+    num_alerts = 0
+    num_allowed = 0
+    transactions = iter(transactions)
+    while True:
+        batch = list(itertools.islice(transactions, batch_size))
+        if not batch:
+            break
+
+        # Only the matching rule of the whitelisted transactions that are shown has to be searched.
+        allowed = rules.check_allowed_many(list(map(lambda x: x[1], batch)))
+        for (line_num, transaction), is_allowed in zip(batch, allowed):
+            if not is_allowed:
+                num_alerts += 1
+                output.write("%d\tALERT\t%s\n" % (line_num, str(transaction)))
+            else:
+                num_allowed += 1
+                if show_allowed:
+                    rule = rules.find_match(transaction)
+                    output.write("%d\tALLOWED\t%s\t%s\n" % (line_num, str(transaction), rule.description))
+    return num_alerts, num_allowed
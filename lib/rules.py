@@ -1,28 +1,51 @@
+import calendar
 import csv
+import decimal
+import re
 import threading
 import hashlib
-import time
 import logging
 from .transaction import AllowedTransaction, SimpleTransaction
+from typing import Dict, List, Optional, Sequence, Tuple
 
 
-class Rules(threading.Thread):
+class Rules(object):
     """
-    Manages the rules for an account and checks for changes in the file.
+    Manages the rules of one csv file. It is shared by all accounts using the same file.
     """
 
+    # Names of the optional columns in the header of the csv file (case insensitive).
+    COLUMN_MAX_AMOUNT = "max amount"
+    COLUMN_TOLERANCE = "tolerance"
+    COLUMN_NAME_REGEX = "name regex"
+    COLUMN_SUBJECT_REGEX = "subject regex"
+
     def __init__(self, file_location: str):
         """
 
         :param file_location: file location for the csv file.
         """
-        threading.Thread.__init__(self)
         self.file_location = file_location
         self.allowed_transactions = set()
         self._lock = threading.Lock()
 
-        # Flag to tell thread to exit.
-        self._exit = False
+        # Index of the rules by (IBAN, currency, amount in cents) to only check the rules that can match
+        # a transaction. Rules with an amount range are indexed with None as amount.
+        self._index = dict()  # type: Dict[Tuple[str, str, Optional[int]], List[AllowedTransaction]]
+
+        # Rules by the columns of their row in the csv file to only parse changed rows on a reload
+        # (and the header the rows were parsed with).
+        self._rows = dict()  # type: Dict[Tuple[str, ...], AllowedTransaction]
+        self._header = None  # type: Optional[Tuple[str, ...]]
+
+        # Rules as column arrays for the batched check (built on first use and after each change).
+        self._columns = None  # type: Optional[Dict[str, object]]
+
+        # Increased each time the rules change, hence results of previous checks can be reused until then.
+        self.generation = 0
+
+        # Number of invalid rows of the last import (a file that could not be parsed counts as one).
+        self.num_errors = 0
 
         # Hash to check if the file has changed.
         self.file_hash = self._create_hash()
@@ -45,6 +68,16 @@ class Rules(threading.Thread):
 
         return md5.hexdigest()
 
+    @staticmethod
+    def _get_index_key(transaction: AllowedTransaction) -> Tuple[str, str, Optional[int]]:
+        """
+        Gets the key of the given rule in the lookup index.
+
+        :param transaction: rule.
+        :return: tuple of IBAN, currency and amount in cents (None for rules with an amount range).
+        """
+        return transaction.iban, transaction.currency, transaction.cents if transaction.is_exact else None
+
     def check_allowed(self, transaction: SimpleTransaction) -> bool:
         """
         Checks if the given transaction is whitelisted by the rules.
@@ -52,67 +85,298 @@ class Rules(threading.Thread):
         :param transaction: transaction object to check.
         :return: True if the given transaction is known.
         """
+        return self.find_match(transaction) is not None
+
+    def find_match(self, transaction: SimpleTransaction) -> Optional[AllowedTransaction]:
+        """
+        Gets the rule that whitelists the given transaction. Only the rules with the IBAN and currency
+        of the transaction are checked, and regular expressions only for rules whose amount and time frame fit.
+
+        :param transaction: transaction object to check.
+        :return: matching rule or None if the transaction is unknown.
+        """
+        with self._lock:
+            for key in ((transaction.iban, transaction.currency, transaction.cents),
+                        (transaction.iban, transaction.currency, None)):
+                candidates = self._index.get(key)
+                if not candidates:
+                    continue
+                for candidate in candidates:
+                    if candidate.check_allowed(transaction):
+                        return candidate
+            return None
+
+    def _get_columns(self, numpy) -> Dict[str, object]:
+        """
+        Gets the rules as column arrays sorted by their group in the lookup index.
+        Has to be called with the lock held.
+
+        :param numpy: numpy module.
+        :return: dictionary with the group ids, the offsets and sizes of the groups in the columns,
+                 and the amount range, the time frame and the regular expression flag of each rule.
+        """
+        if self._columns is not None:
+            return self._columns
+
+        group_ids = dict()
+        group_offsets = list()
+        group_sizes = list()
+        rules = list()
+        for key, candidates in self._index.items():
+            group_ids[key] = len(group_offsets)
+            group_offsets.append(len(rules))
+            group_sizes.append(len(candidates))
+            rules.extend(candidates)
+
+        self._columns = {"group_ids": group_ids,
+                         "group_offsets": numpy.array(group_offsets, dtype=numpy.int64),
+                         "group_sizes": numpy.array(group_sizes, dtype=numpy.int64),
+                         "rules": rules,
+                         "min_cents": numpy.array(list(map(lambda x: x.cents, rules)), dtype=numpy.int64),
+                         "max_cents": numpy.array(list(map(lambda x: x.max_cents, rules)), dtype=numpy.int64),
+                         "start_days": numpy.array(list(map(lambda x: x.start_day, rules)), dtype=numpy.int64),
+                         "end_days": numpy.array(list(map(lambda x: x.end_day, rules)), dtype=numpy.int64),
+                         "has_patterns": numpy.array(list(map(lambda x: x.has_patterns, rules)), dtype=bool)}
+        return self._columns
+
+    @staticmethod
+    def _expand_groups(numpy, columns: Dict[str, object], txn_groups) -> Tuple[object, object]:
+        """
+        Expands each transaction to one entry per rule of its group.
+
+        :param numpy: numpy module.
+        :param columns: column arrays of the rules.
+        :param txn_groups: numpy array with the group id of each transaction (-1 for no group).
+        :return: tuple of numpy arrays with the transaction index and the rule index of each entry.
+        """
+        candidates = numpy.nonzero(txn_groups >= 0)[0]
+        groups = txn_groups[candidates]
+        sizes = columns["group_sizes"][groups]
+        txn_indexes = numpy.repeat(candidates, sizes)
+        first_entries = numpy.repeat(numpy.cumsum(sizes) - sizes, sizes)
+        rule_indexes = (numpy.repeat(columns["group_offsets"][groups], sizes)
+                        + numpy.arange(txn_indexes.size) - first_entries)
+        return txn_indexes, rule_indexes
+
+    def check_allowed_many(self, transactions: Sequence[SimpleTransaction]) -> List[bool]:
+        """
+        Checks a batch of transactions in one vectorized pass with numpy (or one by one if numpy is not
+        installed). The result is the same as calling check_allowed() for each transaction.
+
+        :param transactions: transaction objects to check.
+        :return: list that is True for each known transaction.
+        """
+        try:
+            import numpy
+        except ImportError:
+            return list(map(self.check_allowed, transactions))
+
+        num_transactions = len(transactions)
         with self._lock:
-            return any(map(lambda x: x.check_allowed(transaction), self.allowed_transactions))
+            columns = self._get_columns(numpy)
+            group_ids = columns["group_ids"]
+            exact_groups = numpy.fromiter(map(lambda x: group_ids.get((x.iban, x.currency, x.cents), -1),
+                                              transactions),
+                                          dtype=numpy.int64,
+                                          count=num_transactions)
+            range_groups = numpy.fromiter(map(lambda x: group_ids.get((x.iban, x.currency, None), -1),
+                                              transactions),
+                                          dtype=numpy.int64,
+                                          count=num_transactions)
+
+        mask = numpy.zeros(num_transactions, dtype=bool)
+        if num_transactions == 0:
+            return mask.tolist()
+
+        # Expand each transaction to its candidate rules with the same IBAN and currency.
+        exact_txns, exact_rules = self._expand_groups(numpy, columns, exact_groups)
+        range_txns, range_rules = self._expand_groups(numpy, columns, range_groups)
+        txn_indexes = numpy.concatenate((exact_txns, range_txns))
+        rule_indexes = numpy.concatenate((exact_rules, range_rules))
+        if txn_indexes.size == 0:
+            return mask.tolist()
+
+        cents = numpy.fromiter(map(lambda x: x.cents, transactions), dtype=numpy.int64, count=num_transactions)
+        days = numpy.fromiter(map(lambda x: x.date.day, transactions), dtype=numpy.int64, count=num_transactions)
+        last_days = numpy.fromiter(map(lambda x: calendar.monthrange(x.date.year, x.date.month)[1], transactions),
+                                   dtype=numpy.int64,
+                                   count=num_transactions)
 
-    def exit(self):
+        # Check amount range and time frame (days after the end of the month are the last day of the month).
+        entry_cents = cents[txn_indexes]
+        entry_days = days[txn_indexes]
+        entry_last_days = last_days[txn_indexes]
+        start_days = numpy.minimum(columns["start_days"][rule_indexes], entry_last_days)
+        end_days = numpy.minimum(columns["end_days"][rule_indexes], entry_last_days)
+        in_frame = numpy.where(start_days <= end_days,
+                               (start_days <= entry_days) & (entry_days <= end_days),
+                               (entry_days >= start_days) | (entry_days <= end_days))
+        matches = ((columns["min_cents"][rule_indexes] <= entry_cents)
+                   & (entry_cents <= columns["max_cents"][rule_indexes])
+                   & in_frame)
+
+        # Regular expressions are only checked for the few entries that match otherwise.
+        rules = columns["rules"]
+        for entry in numpy.nonzero(matches & columns["has_patterns"][rule_indexes])[0]:
+            matches[entry] = rules[rule_indexes[entry]].check_patterns(transactions[txn_indexes[entry]])
+
+        mask[txn_indexes[matches]] = True
+        return mask.tolist()
+
+    @staticmethod
+    def _parse_amount(value: str) -> decimal.Decimal:
         """
-        Signals the thread to exit.
+        Parses an amount column of the csv file.
+
+        :param value: column value.
+        :return: amount.
         """
-        self._exit = True
+        try:
+            return decimal.Decimal(value.strip().replace(",", "."))
+        except decimal.InvalidOperation:
+            raise ValueError("Invalid amount '%s'." % value)
+
+    def _parse_row(self, row: List[str], optional_columns: Dict[str, int]) -> AllowedTransaction:
+        """
+        Parses a single row of the csv file.
+
+        :param row: columns of the row.
+        :param optional_columns: positions of the optional columns given in the header.
+        :return: rule of the row.
+        """
+        desc = row[0]
+        iban = row[1].strip().replace(" ","")
+        amount = self._parse_amount(row[2])
+        currency = row[3].strip().replace(" ","")
+        start_day = int(row[4])
+        end_day = int(row[5])
+
+        optional = dict()
+        for name, position in optional_columns.items():
+            optional[name] = row[position].strip() if position < len(row) else ""
+
+        max_amount = None
+        if optional.get(self.COLUMN_MAX_AMOUNT, ""):
+            max_amount = self._parse_amount(optional[self.COLUMN_MAX_AMOUNT])
+        if optional.get(self.COLUMN_TOLERANCE, ""):
+            if max_amount is not None:
+                raise ValueError("Only one of maximum amount and tolerance can be given.")
+            tolerance = self._parse_amount(optional[self.COLUMN_TOLERANCE])
+            if tolerance < 0:
+                raise ValueError("Tolerance has to be at least 0.")
+            max_amount = amount + tolerance
+            amount = amount - tolerance
+
+        try:
+            return AllowedTransaction(desc,
+                                      iban,
+                                      amount,
+                                      currency,
+                                      start_day,
+                                      end_day,
+                                      max_amount,
+                                      optional.get(self.COLUMN_NAME_REGEX, ""),
+                                      optional.get(self.COLUMN_SUBJECT_REGEX, ""))
+        except re.error as e:
+            raise ValueError("Invalid regular expression: %s" % str(e))
 
     def import_csv(self):
         """
-        Imports the csv file for this rules and deletes all old rules.
+        Imports the csv file for this rules and replaces all old rules. Only the rows that changed
+        are parsed and updated in the lookup structures. Invalid rows are skipped.
         """
 
-        transactions = set()
+        rows = dict()  # type: Dict[Tuple[str, ...], AllowedTransaction]
+        old_rows = self._rows
+        header = None
+        optional_columns = dict()
+        num_errors = 0
         try:
             with open(self.file_location, 'r') as fp:
                 csv_reader = csv.reader(fp, quoting=csv.QUOTE_MINIMAL)
-                is_header = True
                 for row in csv_reader:
-                    if is_header:
-                        is_header = False
+                    if csv_reader.line_num == 1:
+                        header = tuple(row)
+                        for position, name in enumerate(row):
+                            name = name.strip().lower()
+                            if name in (self.COLUMN_MAX_AMOUNT,
+                                        self.COLUMN_TOLERANCE,
+                                        self.COLUMN_NAME_REGEX,
+                                        self.COLUMN_SUBJECT_REGEX):
+                                optional_columns[name] = position
+
+                        # Rows have to be parsed again if the columns changed.
+                        if header != self._header:
+                            old_rows = dict()
+                        continue
+
+                    if not row:
                         continue
 
-                    desc = row[0]
-                    iban = row[1].strip().replace(" ","")
-                    amount = float(row[2].replace(",", "."))
-                    currency = row[3].strip().replace(" ","")
-                    start_day = int(row[4])
-                    end_day = int(row[5])
+                    # Reuse the already parsed rule of an unchanged row.
+                    key = tuple(row)
+                    if key in rows.keys():
+                        continue
+                    transaction = old_rows.get(key)
 
-                    transaction = AllowedTransaction(desc, iban, amount, currency, start_day, end_day)
-                    transactions.add(transaction)
+                    if transaction is None:
+                        try:
+                            transaction = self._parse_row(row, optional_columns)
+                        except (ValueError, IndexError) as e:
+                            logging.error("Skipping invalid row %d in rules file '%s': %s",
+                                          csv_reader.line_num, self.file_location, e)
+                            num_errors += 1
+                            continue
 
-            # Replace old transactions.
-            with self._lock:
-                self.allowed_transactions = transactions
+                    rows[key] = transaction
 
         except Exception as e:
-            logging.exception("Parsing rules file '%s' failed." % self.file_location)
+            logging.exception("Parsing rules file '%s' failed.", self.file_location)
+            self.num_errors = 1
+            return
 
-    def run(self):
+        transactions = set(rows.values())
+
+        # Update the rules and the lookup structures in place.
+        with self._lock:
+            added = transactions - self.allowed_transactions
+            removed = self.allowed_transactions - transactions
+
+            for transaction in removed:
+                self.allowed_transactions.remove(transaction)
+                key = self._get_index_key(transaction)
+                self._index[key].remove(transaction)
+                if not self._index[key]:
+                    del self._index[key]
+
+            for transaction in added:
+                self.allowed_transactions.add(transaction)
+                self._index.setdefault(self._get_index_key(transaction), list()).append(transaction)
+
+            if added or removed:
+                self._columns = None
+                self.generation += 1
+
+            self._rows = rows
+            self._header = header
+            self.num_errors = num_errors
+
+        logging.info("Loaded rules file '%s' (%d added, %d removed, %d invalid row(s)).",
+                     self.file_location, len(added), len(removed), num_errors)
+
+    def reload(self):
         """
-        Checks regularly if the csv file has changed and reloads it if it has.
+        Reloads the csv file if its content has changed. Called by the file watcher when the size
+        or modification time of the file has changed.
         """
-        while True:
-
-            logging.debug("Checking rules file '%s'." % self.file_location)
 
-            # Read file if the hash has changed.
-            new_hash = self._create_hash()
-            if new_hash != self.file_hash:
+        logging.debug("Checking rules file '%s'.", self.file_location)
 
-                logging.info("Reloading rules from file '%s'." % self.file_location)
+        # Read file if the hash has changed.
+        new_hash = self._create_hash()
+        if new_hash != self.file_hash:
 
-                self.import_csv()
-                self.file_hash = new_hash
+            logging.info("Reloading rules from file '%s'.", self.file_location)
 
-            # Wait 60 seconds before checking file again.
-            for _ in range(60):
-                if self._exit:
-                    logging.info("Exiting rules thread.")
-                    return
-                time.sleep(1)
\ No newline at end of file
+            self.import_csv()
+            self.file_hash = new_hash
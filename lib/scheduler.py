@@ -0,0 +1,185 @@
+import heapq
+import logging
+import math
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+
+
+class _ScheduleEntry(object):
+    """
+    Schedule of a single account.
+    """
+
+    def __init__(self, account, interval: int, next_run: float):
+        self.account = account
+        self.interval = interval
+        self.next_run = next_run
+        self.failures = 0
+        self.running = False
+        self.removed = False
+
+
+class Scheduler(object):
+    """
+    Schedules the checks of the accounts. Each account is checked at a fixed rate given by its own
+    interval (without drift by the duration of the checks). Accounts that fail repeatedly are checked
+    with an exponentially increasing delay.
+    """
+
+    def __init__(self, max_backoff: int = 3600):
+        """
+
+        :param max_backoff: maximum seconds between two checks of a failing account.
+        """
+        self.max_backoff = max_backoff
+
+        self._cond = threading.Condition()
+        self._entries = dict()  # type: Dict[object, _ScheduleEntry]
+
+        # Heap of (next run, sequence number, entry) of the accounts waiting for their next check.
+        self._heap = list()
+        self._seq = 0
+
+    def _push(self, entry: _ScheduleEntry):
+        """
+        Puts the given entry into the heap. Has to be called with the condition held.
+
+        :param entry: entry to schedule.
+        """
+        self._seq += 1
+        heapq.heappush(self._heap, (entry.next_run, self._seq, entry))
+        self._cond.notify_all()
+
+    def add(self, account, interval: int, start_jitter: float = 0.0):
+        """
+        Adds an account to the schedule.
+
+        :param account: account to check.
+        :param interval: seconds between two checks of the account.
+        :param start_jitter: the first check is started randomly within this many seconds to spread
+                             the checks of the accounts.
+        """
+        next_run = time.monotonic() + random.uniform(0, min(start_jitter, interval))
+        entry = _ScheduleEntry(account, interval, next_run)
+        with self._cond:
+            self._entries[account] = entry
+            self._push(entry)
+
+    def remove(self, account):
+        """
+        Removes an account from the schedule.
+
+        :param account: account to remove.
+        """
+        with self._cond:
+            entry = self._entries.pop(account, None)
+            if entry is not None:
+                entry.removed = True
+
+    def delay(self, account, seconds: float):
+        """
+        Delays the next check of an account that was taken from the schedule with get_due() without
+        counting it as failure.
+
+        :param account: account to delay.
+        :param seconds: seconds to wait before the account is checked.
+        """
+        with self._cond:
+            entry = self._entries.get(account)
+            if entry is None or not entry.running:
+                return
+            entry.running = False
+            entry.next_run = time.monotonic() + seconds
+            self._push(entry)
+
+    def get_due(self) -> List[object]:
+        """
+        Takes all accounts from the schedule whose check is due. They are scheduled again when
+        finish() is called for them.
+
+        :return: list of accounts to check.
+        """
+        now = time.monotonic()
+        due = list()
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                _, _, entry = heapq.heappop(self._heap)
+                if entry.removed or entry.running:
+                    continue
+                entry.running = True
+                due.append(entry.account)
+        return due
+
+    def finish(self, account, success: bool):
+        """
+        Schedules the next check of an account after its check has finished. Does nothing if the
+        account is not running (e.g., it was already finished or delayed).
+
+        :param account: account that was checked.
+        :param success: True if the check succeeded.
+        """
+        now = time.monotonic()
+        with self._cond:
+            entry = self._entries.get(account)
+            if entry is None or not entry.running:
+                return
+            entry.running = False
+
+            if success:
+                entry.failures = 0
+
+                # Keep the fixed rate and skip the runs that were missed because the check took too long.
+                entry.next_run += entry.interval
+                if entry.next_run <= now:
+                    entry.next_run += entry.interval * math.ceil((now - entry.next_run) / entry.interval)
+
+            else:
+                entry.failures += 1
+                backoff = min(entry.interval * (2 ** entry.failures), max(self.max_backoff, entry.interval))
+                entry.next_run = now + backoff
+
+                logging.info("Account '%s' failed %d time(s) in a row. Next check in %d seconds.",
+                             account.name, entry.failures, backoff)
+
+            self._push(entry)
+
+    def get_num_running(self) -> int:
+        """
+        Gets the number of accounts taken from the schedule whose check has not finished yet.
+
+        :return: number of running checks.
+        """
+        with self._cond:
+            return len(list(filter(lambda x: x.running, self._entries.values())))
+
+    def get_num_failing(self) -> int:
+        """
+        Gets the number of accounts whose last check failed.
+
+        :return: number of failing accounts.
+        """
+        with self._cond:
+            return len(list(filter(lambda x: x.failures > 0, self._entries.values())))
+
+    def wait(self, timeout: Optional[float] = None):
+        """
+        Waits until the next check is due or the schedule changed.
+
+        :param timeout: maximum seconds to wait.
+        """
+        with self._cond:
+            wait_time = timeout
+            if self._heap:
+                next_wait = max(self._heap[0][0] - time.monotonic(), 0.0)
+                wait_time = next_wait if wait_time is None else min(wait_time, next_wait)
+            if wait_time is None or wait_time > 0:
+                self._cond.wait(wait_time)
+
+    def wake(self):
+        """
+        Wakes up the threads waiting in wait() (e.g., when the accounts to schedule changed).
+        """
+        with self._cond:
+            self._cond.notify_all()
@@ -0,0 +1,192 @@
+import datetime
+import logging
+import threading
+import time
+from .metrics import metrics
+from .ratelimit import RateLimiter, RateLimitExceeded
+from typing import Any, Callable, Dict, List, Optional
+
+
+def _create_fints_client(blz: str, user: str, password: str, url: str) -> Any:
+    """
+    Creates the FinTS client. The fints package is only imported when the first client is created
+    since importing it takes a noticeable time at startup.
+
+    :return: FinTS client.
+    """
+    from fints.client import FinTS3PinTanClient
+    return FinTS3PinTanClient(blz, user, password, url)
+
+
+class FinTSSession(object):
+    """
+    FinTS session of a single bank login. It is shared by all accounts that use the same login
+    so that the bank is only logged into once and the accounts are only listed once.
+    """
+
+    def __init__(self,
+                 user: str,
+                 password: str,
+                 blz: str,
+                 url: str,
+                 session_ttl: int = 3600,
+                 client_factory: Optional[Callable[[str, str, str, str], Any]] = None,
+                 rate_limiter: Optional[RateLimiter] = None):
+        """
+
+        :param user: user used to login to the bank.
+        :param password: password used to login to the bank
+        :param blz: blz of the login (used in Germany, do not know what banks outside Germany use here)
+        :param url: url to the FinTS access point.
+        :param session_ttl: seconds after which the FinTS client and the cached SEPA accounts are renewed.
+        :param client_factory: function creating the FinTS client from blz, user, password and url
+                               (FinTS3PinTanClient if not given, e.g., replaced by the benchmark).
+        :param rate_limiter: limiter every request to the bank goes through (shared by all sessions of the bank).
+        """
+        self.user = user
+        self.password = password
+        self.blz = blz
+        self.url = url
+        self.session_ttl = session_ttl
+        self.client_factory = client_factory if client_factory is not None else _create_fints_client
+        self.rate_limiter = rate_limiter
+
+        # The FinTS client is not thread safe, hence only one account can use the session at a time.
+        self._lock = threading.Lock()
+
+        # FinTS client and SEPA accounts are reused until an error occurs or they expire.
+        self._fints_client = None
+        self._sepa_accounts = None  # type: Dict[str, Any]
+        self._session_created = 0.0
+
+        # The first request of a client opens the FinTS dialog with the bank.
+        self._logged_in = False
+
+    @staticmethod
+    def get_key(user: str, blz: str, url: str) -> str:
+        """
+        Gets the key identifying a bank login.
+
+        :param user: user used to login to the bank.
+        :param blz: blz of the login.
+        :param url: url to the FinTS access point.
+        :return: key of the bank login.
+        """
+        return "%s|%s|%s" % (user, blz, url)
+
+    def _get_client(self, iban: str) -> Any:
+        """
+        Gets the FinTS client. It is created on first use and reused until it is invalidated or expires.
+
+        :param iban: IBAN of the account the client is used for (used for metrics).
+        :return: FinTS client.
+        """
+
+        if (self._fints_client is not None
+           and (time.monotonic() - self._session_created) > self.session_ttl):
+            logging.debug("FinTS session for user '%s' at '%s' expired.", self.user, self.url)
+            self._invalidate()
+
+        if self._fints_client is None:
+            with metrics.phase(iban, "client"):
+                self._fints_client = self.client_factory(self.blz, self.user, self.password, self.url)
+            self._session_created = time.monotonic()
+            self._logged_in = False
+
+        return self._fints_client
+
+    def _get_sepa_accounts(self, iban: str) -> Dict[str, Any]:
+        """
+        Gets the SEPA accounts of the bank login by their IBAN. They are fetched once per session.
+
+        :param iban: IBAN of the account the SEPA accounts are needed for (used for metrics).
+        :return: dictionary of SEPA accounts with the upper case IBAN as key.
+        """
+
+        if self._sepa_accounts is None:
+            client = self._get_client(iban)
+            sepa_accounts = dict()
+            self._acquire(iban)
+            with self._request_phase(iban, "sepa_accounts"):
+                for sepa_account in client.get_sepa_accounts():
+                    sepa_accounts[sepa_account.iban.upper()] = sepa_account
+            self._sepa_accounts = sepa_accounts
+
+        return self._sepa_accounts
+
+    def _request_phase(self, iban: str, phase: str):
+        """
+        Gets a context manager measuring the duration of a request to the bank. The first request of a client
+        is measured as "login" since it includes opening the FinTS dialog.
+
+        :param iban: IBAN of the account the request is made for.
+        :param phase: name of the phase if the request is not the first one of the client.
+        :return: context manager.
+        """
+        if not self._logged_in:
+            self._logged_in = True
+            return metrics.phase(iban, "login")
+        return metrics.phase(iban, phase)
+
+    def _acquire(self, iban: str):
+        """
+        Takes the permission for one request to the bank from the rate limiter.
+
+        :param iban: IBAN of the account the request is made for (used for metrics).
+        :raises RateLimitExceeded: if the request is not allowed at the moment.
+        """
+        if self.rate_limiter is None:
+            return
+        try:
+            with metrics.phase(iban, "rate_limit"):
+                self.rate_limiter.acquire()
+        except RateLimitExceeded:
+            metrics.add(iban, "rate_limited")
+            raise
+
+    def _invalidate(self):
+        """
+        Discards the FinTS client and the cached SEPA accounts.
+        """
+        self._fints_client = None
+        self._sepa_accounts = None
+
+    def get_transactions(self, iban: str, start_date: datetime.date, end_date: datetime.date) -> List[Any]:
+        """
+        Fetches the transactions of the account with the given IBAN.
+
+        :param iban: upper case IBAN of the account.
+        :param start_date: first day of the transactions to fetch.
+        :param end_date: last day of the transactions to fetch.
+        :return: list of transactions as returned by the FinTS client.
+        """
+
+        with self._lock:
+            try:
+                cached = self._sepa_accounts is not None
+                sepa_accounts = self._get_sepa_accounts(iban)
+
+                # Fetch the SEPA accounts again if the account was added after they were cached.
+                if iban not in sepa_accounts.keys() and cached:
+                    self._sepa_accounts = None
+                    sepa_accounts = self._get_sepa_accounts(iban)
+
+                if iban in sepa_accounts.keys():
+                    client = self._get_client(iban)
+                    self._acquire(iban)
+                    with self._request_phase(iban, "transactions"):
+                        return client.get_transactions(sepa_accounts[iban], start_date, end_date)
+
+            # Keep the session if the request was not made because of the rate limit.
+            except RateLimitExceeded:
+                raise
+
+            # Start with a new session on the next call if the bank communication failed
+            # (e.g., authentication or dialog errors).
+            except Exception:
+                self._invalidate()
+                raise
+
+        # The session is kept if the account does not exist since the bank communication worked.
+        raise ValueError("Account with IBAN '%s' not found for user '%s' at '%s'."
+                         % (iban, self.user, self.url))
@@ -0,0 +1,143 @@
+import datetime
+import sqlite3
+import threading
+from typing import Iterable, Optional, Set, Tuple
+
+
+class Storage(object):
+    """
+    Persists the state of the monitored accounts in a sqlite database.
+    """
+
+    def __init__(self, file_location: str):
+        """
+
+        :param file_location: file location of the sqlite database.
+        """
+        self.file_location = file_location
+
+        # The connection is shared by all threads and hence guarded by a lock. The database can also be
+        # shared by multiple worker processes, hence they wait for each other's write locks.
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(file_location, timeout=30.0, check_same_thread=False)
+        self._create_tables()
+
+    def _create_tables(self):
+        """
+        Creates the tables of the database if they do not exist.
+        """
+        with self._lock:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS high_water_marks ("
+                               + "account TEXT PRIMARY KEY, "
+                               + "date TEXT NOT NULL, "
+                               + "fingerprints TEXT NOT NULL)")
+
+            # Fingerprints of transactions that triggered an event bucketed by the day of the transaction
+            # (ordinal of the date) to be able to drop expired days at once.
+            self._conn.execute("CREATE TABLE IF NOT EXISTS triggered_transactions ("
+                               + "account TEXT NOT NULL, "
+                               + "bucket INTEGER NOT NULL, "
+                               + "fingerprint TEXT NOT NULL, "
+                               + "PRIMARY KEY (account, bucket, fingerprint)) WITHOUT ROWID")
+            self._conn.commit()
+
+    def close(self):
+        """
+        Closes the database.
+        """
+        with self._lock:
+            self._conn.close()
+
+    def get_high_water_mark(self, account: str) -> Tuple[Optional[datetime.date], Set[str]]:
+        """
+        Gets the high-water mark of the given account.
+
+        :param account: key of the account.
+        :return: tuple of the last fetched date (None if the account was never fetched)
+                 and the fingerprints of the transactions seen on that date.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT date, fingerprints FROM high_water_marks WHERE account = ?",
+                                     (account, )).fetchone()
+
+        if row is None:
+            return None, set()
+
+        date = datetime.datetime.strptime(row[0], "%Y-%m-%d").date()
+        fingerprints = set(row[1].split(",")) if row[1] else set()
+        return date, fingerprints
+
+    def set_high_water_mark(self, account: str, date: datetime.date, fingerprints: Set[str]):
+        """
+        Sets the high-water mark of the given account.
+
+        :param account: key of the account.
+        :param date: last fetched date.
+        :param fingerprints: fingerprints of the transactions seen on that date.
+        """
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO high_water_marks (account, date, fingerprints) "
+                               + "VALUES (?, ?, ?)",
+                               (account, date.strftime("%Y-%m-%d"), ",".join(sorted(fingerprints))))
+            self._conn.commit()
+
+    def get_triggered(self, account: str, start_date: datetime.date, end_date: datetime.date) -> Set[str]:
+        """
+        Gets the fingerprints of the transactions of the given account that already triggered an event.
+
+        :param account: key of the account.
+        :param start_date: first day of the transactions to get.
+        :param end_date: last day of the transactions to get.
+        :return: set of fingerprints.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT fingerprint FROM triggered_transactions "
+                                      + "WHERE account = ? AND bucket BETWEEN ? AND ?",
+                                      (account, start_date.toordinal(), end_date.toordinal())).fetchall()
+        return set(map(lambda x: x[0], rows))
+
+    def add_triggered(self, account: str, transactions: Iterable[Tuple[datetime.date, str]]):
+        """
+        Adds the fingerprints of transactions of the given account that triggered an event.
+
+        :param account: key of the account.
+        :param transactions: tuples of the date and the fingerprint of the transactions.
+        """
+        with self._lock:
+            self._conn.executemany("INSERT OR IGNORE INTO triggered_transactions (account, bucket, fingerprint) "
+                                   + "VALUES (?, ?, ?)",
+                                   map(lambda x: (account, x[0].toordinal(), x[1]), transactions))
+            self._conn.commit()
+
+    def claim_triggered(self, account: str, transactions: Iterable[Tuple[datetime.date, str]]) -> Set[str]:
+        """
+        Adds the fingerprints of transactions of the given account that triggered an event and returns
+        the ones that were not stored before. Since adding a fingerprint is atomic, only one process
+        sharing the database claims a transaction (and sends its notification).
+
+        :param account: key of the account.
+        :param transactions: tuples of the date and the fingerprint of the transactions.
+        :return: set of the claimed fingerprints.
+        """
+        claimed = set()
+        with self._lock:
+            with self._conn:
+                for date, fingerprint in transactions:
+                    cursor = self._conn.execute("INSERT OR IGNORE INTO triggered_transactions "
+                                                + "(account, bucket, fingerprint) VALUES (?, ?, ?)",
+                                                (account, date.toordinal(), fingerprint))
+                    if cursor.rowcount == 1:
+                        claimed.add(fingerprint)
+        return claimed
+
+    def remove_triggered_before(self, account: str, date: datetime.date):
+        """
+        Removes the days before the given date from the triggered transactions of the given account.
+
+        :param account: key of the account.
+        :param date: first day that is kept.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM triggered_transactions WHERE account = ? AND bucket < ?",
+                               (account, date.toordinal()))
+            self._conn.commit()
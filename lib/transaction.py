@@ -1,49 +1,95 @@
+import calendar
 import datetime
-from typing import Any
+import decimal
+import hashlib
+import re
+from typing import Any, Optional, Union
+
+
+def to_cents(amount: Union[decimal.Decimal, float, int, str]) -> int:
+    """
+    Converts the given amount into exact integer cents.
+
+    :param amount: amount (floats are converted via their shortest string representation).
+    :return: amount in cents.
+    """
+    if isinstance(amount, float):
+        amount = repr(amount)
+    cents = decimal.Decimal(amount).scaleb(2).to_integral_value(rounding=decimal.ROUND_HALF_UP)
+    return int(cents)
 
 
 class SimpleTransaction(object):
     """
-    Contains a single transaction in a simplified form.
+    Contains a single transaction in a simplified form. The object must not be changed after
+    its creation since its hash is computed only once.
     """
 
-    def __init__(self, name: str, iban: str, amount: float, currency: str, date: datetime.date, subject: str):
+    __slots__ = ("currency", "cents", "name", "iban", "date", "subject", "_key", "_hash", "_fingerprint")
+
+    def __init__(self,
+                 name: str,
+                 iban: str,
+                 amount: Union[decimal.Decimal, float, int, str],
+                 currency: str,
+                 date: datetime.date,
+                 subject: str):
         self.currency = currency.upper()
-        self.amount = amount
+        self.cents = to_cents(amount)
         self.name = name
         self.iban = iban.upper()
         self.date = date
         self.subject = subject
+        self._key = (self.currency, self.cents, self.name, self.iban, self.date, self.subject)
+        self._hash = hash(self._key)
+        self._fingerprint = None
+
+    @property
+    def amount(self) -> decimal.Decimal:
+        """
+        Exact amount of the transaction.
+        """
+        return decimal.Decimal(self.cents).scaleb(-2)
 
     def __eq__(self, other: Any) -> bool:
-        if type(self) != type(other):
-            return False
-        if (self.currency == other.currency
-           and self.amount == other.amount
-           and self.name == other.name
-           and self.iban == other.iban
-           and self.date == other.date
-           and self.subject == other.subject):
+        if self is other:
             return True
-        else:
+        if type(self) != type(other):
             return False
+        return self._hash == other._hash and self._key == other._key
 
     def __hash__(self) -> int:
-        return hash((self.currency, self.amount, self.name, self.iban, self.date, self.subject))
+        return self._hash
+
+    def get_fingerprint(self) -> str:
+        """
+        Gets a compact fingerprint of this transaction that stays the same over restarts.
+
+        :return: hex string of the fingerprint.
+        """
+        if self._fingerprint is None:
+            data = "\x1f".join([self.currency,
+                                "%d" % self.cents,
+                                self.name,
+                                self.iban,
+                                self.date.strftime("%Y-%m-%d"),
+                                self.subject])
+            self._fingerprint = hashlib.blake2b(data.encode("utf-8"), digest_size=12).hexdigest()
+        return self._fingerprint
 
     def __str__(self) -> str:
         date_str = self.date.strftime("%Y-%m-%d")
-        final_str = "%s: " % date_str
-        if self.amount < 0:
+        amount = self.amount
+        if amount < 0:
             final_str = "%s: %.2f %s to %s (%s) with subject '%s'" % (date_str,
-                                                                    self.amount * (-1),
+                                                                    amount * (-1),
                                                                     self.currency,
                                                                     self.iban,
                                                                     self.name,
                                                                     self.subject)
         else:
             final_str = "%s: %.2f %s from %s (%s) with subject '%s'" % (date_str,
-                                                                      self.amount,
+                                                                      amount,
                                                                       self.currency,
                                                                       self.iban,
                                                                       self.name,
@@ -54,36 +100,121 @@ class SimpleTransaction(object):
 
 class AllowedTransaction(object):
     """
-    A whitelisted transaction (or rule).
+    A whitelisted transaction (or rule). The object must not be changed after its creation
+    since its hash is computed only once.
     """
 
-    def __init__(self, desc: str, iban: str, amount: float, currency: str, start_d: int, end_d: int):
+    __slots__ = ("description", "currency", "cents", "max_cents", "iban", "start_day", "end_day",
+                 "name_regex", "subject_regex", "_name_pattern", "_subject_pattern", "_key", "_hash")
+
+    def __init__(self,
+                 desc: str,
+                 iban: str,
+                 amount: Union[decimal.Decimal, float, int, str],
+                 currency: str,
+                 start_d: int,
+                 end_d: int,
+                 max_amount: Optional[Union[decimal.Decimal, float, int, str]] = None,
+                 name_regex: str = "",
+                 subject_regex: str = ""):
+        """
+
+        :param desc: description of the rule.
+        :param iban: IBAN of the other party.
+        :param amount: amount of the transaction (minimum amount if a maximum amount is given).
+        :param currency: currency of the transaction.
+        :param start_d: first day of the month the rule is active. If it is larger than the end day,
+                        the time frame crosses the end of the month.
+        :param end_d: last day of the month the rule is active (days after the end of a month are
+                      treated as the last day of the month).
+        :param max_amount: maximum amount of the transaction (None to only allow the exact amount).
+        :param name_regex: regular expression the name of the other party has to contain (case insensitive).
+        :param subject_regex: regular expression the subject has to contain (case insensitive).
+        """
+        if not (1 <= start_d <= 31 and 1 <= end_d <= 31):
+            raise ValueError("Start day and end day have to be between 1 and 31.")
+
         self.description = desc
         self.currency = currency.upper()
-        self.amount = amount
+        self.cents = to_cents(amount)
+        self.max_cents = self.cents if max_amount is None else to_cents(max_amount)
+        if self.max_cents < self.cents:
+            raise ValueError("Maximum amount is smaller than amount.")
         self.iban = iban.upper()
         self.start_day = start_d
         self.end_day = end_d
+        self.name_regex = name_regex
+        self.subject_regex = subject_regex
+        self._name_pattern = re.compile(name_regex, re.IGNORECASE) if name_regex else None
+        self._subject_pattern = re.compile(subject_regex, re.IGNORECASE) if subject_regex else None
+        self._key = (self.description,
+                     self.iban,
+                     self.cents,
+                     self.max_cents,
+                     self.currency,
+                     self.start_day,
+                     self.end_day,
+                     self.name_regex,
+                     self.subject_regex)
+        self._hash = hash(self._key)
+
+    @property
+    def amount(self) -> decimal.Decimal:
+        """
+        Exact (or minimum) amount of the rule.
+        """
+        return decimal.Decimal(self.cents).scaleb(-2)
+
+    @property
+    def is_exact(self) -> bool:
+        """
+        True if the rule only allows one exact amount.
+        """
+        return self.cents == self.max_cents
+
+    @property
+    def has_patterns(self) -> bool:
+        """
+        True if the rule has regular expressions for the name or the subject.
+        """
+        return self._name_pattern is not None or self._subject_pattern is not None
 
     def __eq__(self, other: Any) -> bool:
+        if self is other:
+            return True
         if type(self) != type(other):
             return False
-        if (self.currency == other.currency
-           and self.description == other.description
-           and self.amount == other.amount
-           and self.iban == other.iban
-           and self.start_day == other.start_day
-           and self.end_day == other.end_day):
-            return True
-        return False
+        return self._hash == other._hash and self._key == other._key
 
     def __hash__(self) -> int:
-        return hash((self.description,
-                     self.iban,
-                     self.amount,
-                     self.currency,
-                     self.start_day,
-                     self.end_day))
+        return self._hash
+
+    def check_day(self, date: datetime.date) -> bool:
+        """
+        Checks if the given day lies in the time frame of this rule for the month of the day.
+
+        :param date: day to check.
+        :return: True if the day lies in the time frame.
+        """
+        last_day = calendar.monthrange(date.year, date.month)[1]
+        start_day = min(self.start_day, last_day)
+        end_day = min(self.end_day, last_day)
+        if start_day <= end_day:
+            return start_day <= date.day <= end_day
+        return date.day >= start_day or date.day <= end_day
+
+    def check_patterns(self, transaction: SimpleTransaction) -> bool:
+        """
+        Checks if the name and the subject of the given transaction match the regular expressions of this rule.
+
+        :param transaction: transaction object to check.
+        :return: True if the regular expressions match (or this rule has none).
+        """
+        if self._name_pattern is not None and self._name_pattern.search(transaction.name) is None:
+            return False
+        if self._subject_pattern is not None and self._subject_pattern.search(transaction.subject) is None:
+            return False
+        return True
 
     def check_allowed(self, transaction: SimpleTransaction) -> bool:
         """
@@ -93,16 +224,9 @@ class AllowedTransaction(object):
         :return: True if the given transaction fits to this rule.
         """
 
-        year = datetime.date.today().year
-        month = datetime.date.today().month
-        start_date = datetime.date(year, month, self.start_day)
-        end_date = datetime.date(year, month, self.end_day)
-
-        if (start_date <= transaction.date <= end_date
-           and self.amount == transaction.amount
+        if (self.cents <= transaction.cents <= self.max_cents
            and self.currency == transaction.currency
-           and self.iban == transaction.iban):
-            return True
+           and self.iban == transaction.iban
+           and self.check_day(transaction.date)):
+            return self.check_patterns(transaction)
         return False
-
-
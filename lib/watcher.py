@@ -0,0 +1,211 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import threading
+from .profiler import profiler
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class FileWatcher(threading.Thread):
+    """
+    Watches files for changes and notifies the registered callbacks. Uses inotify where available
+    and falls back to checking the size and modification time of the files regularly.
+    """
+
+    # inotify flags (see inotify(7)).
+    _IN_MODIFY = 0x00000002
+    _IN_ATTRIB = 0x00000004
+    _IN_CLOSE_WRITE = 0x00000008
+    _IN_MOVED_TO = 0x00000080
+    _IN_CREATE = 0x00000100
+    _IN_DELETE = 0x00000200
+    _IN_NONBLOCK = os.O_NONBLOCK
+    _IN_CLOEXEC = os.O_CLOEXEC
+
+    def __init__(self, poll_interval: int = 60):
+        """
+
+        :param poll_interval: seconds between checks of all files (also done when inotify is used
+                              to notice changes inotify does not report, e.g., on network file systems).
+        """
+        threading.Thread.__init__(self, name="FileWatcher")
+        self.daemon = True
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+
+        # Callbacks and last seen (size, modification time) of the watched files.
+        self._callbacks = dict()  # type: Dict[str, List[Callable[[], None]]]
+        self._signatures = dict()  # type: Dict[str, Optional[Tuple[int, int]]]
+
+        # Pipe to wake up the thread on exit.
+        self._exit = False
+        self._wakeup_read, self._wakeup_write = os.pipe()
+
+        self._inotify_fd = None  # type: Optional[int]
+        self._inotify_dirs = dict()  # type: Dict[int, str]
+        self._libc = None
+        self._init_inotify()
+
+    def _init_inotify(self):
+        """
+        Initializes inotify if it is available on this system.
+        """
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(self._IN_NONBLOCK | self._IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        except (OSError, AttributeError) as e:
+            logging.info("inotify not available (%s). Checking files every %d seconds.",
+                         e, self.poll_interval)
+            return
+
+        self._libc = libc
+        self._inotify_fd = fd
+
+    def _add_inotify_watch(self, directory: str):
+        """
+        Adds an inotify watch for the given directory (directories are watched to also notice files
+        that are replaced by editors).
+
+        :param directory: directory to watch.
+        """
+        if self._inotify_fd is None or directory in self._inotify_dirs.values():
+            return
+
+        mask = (self._IN_MODIFY | self._IN_ATTRIB | self._IN_CLOSE_WRITE
+                | self._IN_MOVED_TO | self._IN_CREATE | self._IN_DELETE)
+        wd = self._libc.inotify_add_watch(self._inotify_fd, directory.encode("utf-8"), mask)
+        if wd < 0:
+            logging.warning("Not able to watch directory '%s' with inotify (errno %d).",
+                            directory, ctypes.get_errno())
+            return
+        self._inotify_dirs[wd] = directory
+
+    @staticmethod
+    def _get_signature(file_location: str) -> Optional[Tuple[int, int]]:
+        """
+        Gets the size and modification time of the given file.
+
+        :param file_location: file location.
+        :return: tuple of size and modification time or None if the file does not exist.
+        """
+        try:
+            stat = os.stat(file_location)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def register(self, file_location: str, callback: Callable[[], None]):
+        """
+        Registers a callback that is called when the given file changes.
+
+        :param file_location: file location to watch.
+        :param callback: function called on a change.
+        """
+        file_location = os.path.abspath(file_location)
+        with self._lock:
+            if file_location not in self._callbacks.keys():
+                self._callbacks[file_location] = list()
+                self._signatures[file_location] = self._get_signature(file_location)
+                self._add_inotify_watch(os.path.dirname(file_location))
+            self._callbacks[file_location].append(callback)
+
+    def unregister(self, file_location: str, callback: Callable[[], None]):
+        """
+        Unregisters a callback of the given file.
+
+        :param file_location: file location that is watched.
+        :param callback: function that was registered.
+        """
+        file_location = os.path.abspath(file_location)
+        with self._lock:
+            callbacks = self._callbacks.get(file_location, list())
+            if callback in callbacks:
+                callbacks.remove(callback)
+            if not callbacks:
+                self._callbacks.pop(file_location, None)
+                self._signatures.pop(file_location, None)
+
+    def exit(self):
+        """
+        Signals the thread to exit.
+        """
+        self._exit = True
+        os.write(self._wakeup_write, b"\x00")
+
+    def _check_files(self, directory: Optional[str] = None):
+        """
+        Checks the watched files for changes and calls their callbacks.
+
+        :param directory: only check the files in this directory (None for all files).
+        """
+        changed = list()
+        with self._lock:
+            for file_location in self._callbacks.keys():
+                if directory is not None and os.path.dirname(file_location) != directory:
+                    continue
+                signature = self._get_signature(file_location)
+                if signature != self._signatures[file_location]:
+                    self._signatures[file_location] = signature
+                    changed.append((file_location, list(self._callbacks[file_location])))
+
+        for file_location, callbacks in changed:
+            logging.debug("File '%s' changed.", file_location)
+            for callback in callbacks:
+                try:
+                    profiler.run(callback)
+                except Exception as e:
+                    logging.exception("Processing change of file '%s' failed.", file_location)
+
+    def _read_inotify_dirs(self) -> List[str]:
+        """
+        Reads all pending inotify events.
+
+        :return: list of directories with changes.
+        """
+        directories = list()
+        while True:
+            try:
+                data = os.read(self._inotify_fd, 65536)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+
+            # Each event starts with wd, mask, cookie and length of the name (struct inotify_event).
+            pos = 0
+            while pos + 16 <= len(data):
+                wd, _, _, name_len = struct.unpack_from("iIII", data, pos)
+                pos += 16 + name_len
+                directory = self._inotify_dirs.get(wd)
+                if directory is not None and directory not in directories:
+                    directories.append(directory)
+        return directories
+
+    def run(self):
+        """
+        Waits for changes of the watched files.
+        """
+        fds = [self._wakeup_read]
+        if self._inotify_fd is not None:
+            fds.append(self._inotify_fd)
+
+        while not self._exit:
+            readable, _, _ = select.select(fds, [], [], self.poll_interval)
+
+            if self._exit:
+                break
+
+            # Only check the files of the changed directories on an inotify event,
+            # otherwise check all files regularly.
+            if self._inotify_fd in readable:
+                for directory in self._read_inotify_dirs():
+                    self._check_files(directory)
+            else:
+                self._check_files()
+
+        logging.info("Exiting file watcher thread.")